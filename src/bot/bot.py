@@ -1,6 +1,5 @@
 # Maintains set of active game sessions and handles Discord interactions
 
-import json
 import logging
 import sys
 from pprint import pformat
@@ -9,8 +8,8 @@ import interactions
 from interactions import Intents
 
 from client import populate_emoji_map, load_active_games
-from commands import register_commands, refresh_emoji_names
-from config import BOT_TOKEN, EMOJI_CACHE_FILE
+from commands import register_commands, load_emoji_names, refresh_emoji_names
+from config import BOT_TOKEN, DISABLE_COMMAND_SYNC
 
 # TODO:
 # - Look into multiprocessing to speed up the bot
@@ -45,28 +44,12 @@ from config import BOT_TOKEN, EMOJI_CACHE_FILE
 
 logger = logging.getLogger(__name__)
 
-# TODO: figure out what file to put this in; it doesn't seem to belong anywhere in particular
-# Probably the serializer module, when I get around to writing it (PersistenceManager? PersistenceService?)
-def load_emoji_names() -> dict[str, str]:
-    '''Load the emoji names from the emoji_map JSON file'''
-    # Open the emoji_map JSON file
-    try:
-        with open(EMOJI_CACHE_FILE, 'r') as f:
-            # Load the JSON file
-            emoji_map = json.load(f)
-            logger.info('Emoji map loaded from file')
-            return emoji_map
-    except FileNotFoundError:
-        # If the file does not exist, return None so the calling function can create it via refresh_emoji_names
-        logger.warning('Emoji map file not found; querying Discord API for emoji IDs')
-        return None
-
 def run():
     # Load the active games into the game manager
     load_active_games()
     # client = interactions.Client(token=BOT_TOKEN, intents=Intents.DEFAULT | Intents.GUILD_MESSAGE_CONTENT)
     # It seems like GUILD_MESSAGE_CONTENT isn't required to pick up relevant THREAD_CREATED events, so we'll leave it out for now
-    bot = interactions.Client(token=BOT_TOKEN, intents=Intents.DEFAULT)
+    bot = interactions.Client(token=BOT_TOKEN, intents=Intents.DEFAULT, disable_sync=DISABLE_COMMAND_SYNC)
     register_commands(bot)
 
     @bot.event
@@ -2,9 +2,11 @@
 # No surprises here, just a bunch of attributes.
 
 import logging
+import sys
+from enum import IntFlag
 from typing import Any
 
-from attrs import define
+from attrs import define, field, setters
 from chess import BLACK, WHITE, Color
 from game import Player
 from interactions import Snowflake
@@ -13,6 +15,45 @@ logger = logging.getLogger(__name__)
 
 # TODO: handle serializable classes via a metaclass or mixin
 
+class Ping(IntFlag):
+    '''Which players to ping on their turn, parsed from the ClientOptions.ping string.'''
+    NONE = 0
+    AUTHOR = 1
+    OPPONENT = 2
+    BOTH = AUTHOR | OPPONENT
+
+# Maps each accepted ClientOptions.ping string to its Ping value
+_PING_OPTIONS = {
+    'none': Ping.NONE,
+    'author': Ping.AUTHOR,
+    'opponent': Ping.OPPONENT,
+    'both': Ping.BOTH,
+}
+
+def _to_player(player: Player | dict[str, str] | None) -> Player | None:
+    '''Converter for ClientOptions.author and ClientOptions.opponent: builds a Player from its dict form.'''
+    return Player.from_dict(player) if isinstance(player, dict) else player
+
+def _intern_ping(ping: str) -> str:
+    '''Converter for ClientOptions.ping: interns it so the comparisons against literals hit the identity fast path.'''
+    return sys.intern(ping)
+
+def _validate_ping(instance, attribute, ping: str):
+    '''Validator for ClientOptions.ping.'''
+    if ping not in _PING_OPTIONS:
+        raise ValueError(f'invalid ping option: {ping!r}')
+
+def _forget_derived(instance: 'ClientOptions', attribute, value):
+    '''on_setattr hook for the fields the cached lookups are derived from. Drops the lookups, so they're rebuilt from the new value on next use.'''
+    instance._players = None
+    instance._mentions = None
+    instance._ping_colors = None
+    return value
+
+# Convert and validate reassigned values as attrs does by default, then drop whatever was derived from the old value
+_ON_SOURCE_SETATTR = setters.pipe(setters.convert, setters.validate, _forget_derived)
+
+# attrs' define() generates __slots__, so instances have no per-instance __dict__
 @define
 class ClientOptions:
     '''
@@ -30,17 +71,23 @@ class ClientOptions:
     :param bool private: whether the game is private
     '''
 
-    author: Player | dict[str, str]
-    opponent: Player | dict[str, str]
+    author: Player | dict[str, str] = field(converter=_to_player, on_setattr=_ON_SOURCE_SETATTR)
+    opponent: Player | dict[str, str] = field(converter=_to_player, on_setattr=_ON_SOURCE_SETATTR)
     channel_id: Snowflake | str
     players: int = 1
     notation: str = 'san'
-    ping: str = 'none'
+    ping: str = field(default='none', converter=_intern_ping, validator=_validate_ping, on_setattr=_ON_SOURCE_SETATTR)
     name: str = 'Game'
     engine: str | None = None
-    engine_options: dict[str, str] = {}
+    engine_options: dict[str, str] = field(factory=dict)
     time_control: str | None = None
     private: bool = False
+    # String form of channel_id, computed once in __attrs_post_init__
+    _channel_id_str: str = field(init=False, repr=False, eq=False)
+    # Built on first use, and dropped by _forget_derived whenever a field they're derived from is reassigned
+    _players: dict[Color, Player] | None = field(init=False, default=None, repr=False, eq=False)
+    _mentions: dict[Color, str] | None = field(init=False, default=None, repr=False, eq=False)
+    _ping_colors: frozenset[Color] | None = field(init=False, default=None, repr=False, eq=False)
 
     def __attrs_post_init__(self):
         if self.author is None:
@@ -49,68 +96,96 @@ class ClientOptions:
             raise ValueError('missing required argument for 2-player game: opponent')
         if self.channel_id is None:
             raise ValueError('missing required argument: channel_id')
-        self.author = Player.from_dict(self.author) if isinstance(self.author, dict) else self.author
-        self.opponent = Player.from_dict(self.opponent) if isinstance(self.opponent, dict) else self.opponent
+        # Intern the option strings so the repeated comparisons against literals hit the identity fast path
+        self.notation = sys.intern(self.notation)
+        if self.engine is not None:
+            self.engine = sys.intern(self.engine)
+        # channel_id may be a Snowflake; only stringify it once
+        self._channel_id_str = str(self.channel_id)
     
+    def _color_players(self) -> dict[Color, Player]:
+        '''Returns the players keyed by color (the author wins if both somehow have the same color), building the map on first use.'''
+        if self._players is None:
+            self._players = {p.color: p for p in (self.opponent, self.author) if p is not None}
+        return self._players
+
+    def _color_mentions(self) -> dict[Color, str]:
+        '''Returns the ping string for each human player, keyed by color (the engine has no ID to ping), building it on first use.'''
+        if self._mentions is None:
+            self._mentions = {p.color: f'<@{p.id}>' for p in (self.author, self.opponent) if p is not None and p.id is not None}
+        return self._mentions
+
+    def _ping_targets(self) -> frozenset[Color]:
+        '''Returns the colors whose player should be pinged (only players with an ID can be), resolving the ping policy on first use.'''
+        if self._ping_colors is None:
+            ping = _PING_OPTIONS[self.ping]
+            ping_targets = set()
+            if ping & Ping.AUTHOR and self.author.id is not None:
+                ping_targets.add(self.author.color)
+            if ping & Ping.OPPONENT and self.opponent is not None and self.opponent.id is not None:
+                ping_targets.add(self.opponent.color)
+            self._ping_colors = frozenset(ping_targets)
+        return self._ping_colors
+
     # Properties
     # TODO: remove unused properties
     @property
-    def player(self, color: Color) -> Player:
-        '''Returns the Player playing the given color.'''
-        return self.author if self.author.color == color else self.opponent
-    @property
     def black_player(self) -> Player:
         '''Returns the Player playing black.'''
-        return self.author if self.author.color == BLACK else self.opponent
+        return self._color_players().get(BLACK)
     @property
     def white_player(self) -> Player:
         '''Returns the Player playing white.'''
-        return self.author if self.author.color == WHITE else self.opponent
+        return self._color_players().get(WHITE)
     @property
     def ping_black(self) -> bool:
         '''Returns True if the black player should be pinged, False otherwise.'''
-        return self.ping == 'both' or (self.ping == 'author' and self.author == self.black_player) or (self.ping == 'opponent' and self.opponent == self.black_player)
+        return BLACK in self._ping_targets()
     @property
     def ping_white(self) -> bool:
         '''Returns True if the white player should be pinged, False otherwise.'''
-        return self.ping == 'both' or (self.ping == 'author' and self.author == self.white_player) or (self.ping == 'opponent' and self.opponent == self.white_player)
+        return WHITE in self._ping_targets()
     
     # Methods
+    def player(self, color: Color) -> Player:
+        '''Returns the Player playing the given color.'''
+        return self._color_players().get(color)
+
     def get_ping_str(self, color: Color) -> str | None:
         '''Returns the string to use for pinging the player of the given color, or None if the player should not be pinged.'''
+        # Players without an ID (the engine) have no mention, so they're never pinged
         if color == WHITE and self.ping_white:
-            return f'<@{self.white_player.id}>'
+            return self._color_mentions().get(WHITE)
         elif color == BLACK and self.ping_black:
-            return f'<@{self.black_player.id}>'
+            return self._color_mentions().get(BLACK)
         else:
             return None
     
     def get_id(self, color: Color) -> str:
         '''Returns the Discord ID of the player of the given color.'''
-        return self.white_player.id if color == WHITE else self.black_player.id
+        return self._color_players()[color].id
         
     def get_nick(self, color: Color) -> str:
         '''Returns the nickname of the player of the given color.'''
-        return self.white_player.nick if color == WHITE else self.black_player.nick
+        return self._color_players()[color].nick
     
     def get_ping_or_nick(self, color: Color) -> str:
         '''Returns the string to use for pinging the player of the given color, or their nickname if they should not be pinged.'''
         ping_str = self.get_ping_str(color)
         if ping_str is None:
-            return self.white_player.nick if color == WHITE else self.black_player.nick
+            return self._color_players()[color].nick
         else:
             return ping_str
 
     def to_dict(self) -> dict[str, Any]:
         '''Returns a dictionary representation of the ClientOptions object.'''
-        logger.debug('Converting ClientOptions object to dictionary.')
         return {
             'author': self.author.to_dict(),
             'opponent': self.opponent.to_dict(),
             'players': self.players,
             'notation': self.notation,
             'ping': self.ping,
-            'channel_id': str(self.channel_id),
+            'channel_id': self._channel_id_str,
             'name': self.name,
             'engine': self.engine,
             'engine_options': self.engine_options,
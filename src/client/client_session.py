@@ -1,16 +1,15 @@
 import asyncio
-import json
 import logging
-from typing import Any
+from collections import OrderedDict
+from typing import Any, Callable
 
 import interactions
 from attrs import define
-from chess import (BLACK, WHITE, AmbiguousMoveError, Board, IllegalMoveError,
-                   InvalidMoveError)
+from chess import (BLACK, WHITE, AmbiguousMoveError, Board, Color,
+                   IllegalMoveError, InvalidMoveError, Termination)
 from interactions import Snowflake
 
-from config import (DEFAULT_GAME_OPTIONS, ENGINE_HOST, ENGINE_PORT, ENGINE_PW,
-                    ENGINE_USER)
+from config import ENGINE_HOST, ENGINE_PORT, ENGINE_PW, ENGINE_USER
 from game import GameSession, correct_bad_move, disambiguate_move
 
 from .client_options import ClientOptions
@@ -34,14 +33,41 @@ from .strings import (checkmate_1p, checkmate_2p, checkmate_2p_upset, draw_1p,
 logger = logging.getLogger(__name__)
 
 
+# Boards built by moves_to_board, keyed by their moves string, least recently used first.
+# A game's moves string only ever grows, so a cached prefix saves replaying all but the newest moves.
+MOVES_TO_BOARD_CACHE_SIZE = 1024
+_board_cache: OrderedDict[str, Board] = OrderedDict()
+
 def moves_to_board(moves: str) -> Board:
-    '''Given a string of moves, return a chess.Board. Raises ValueError if the moves are invalid.'''
-    # Create a new GameSession (useful for parsing moves)
-    game_session = GameSession()
-    for move_str in moves.split(' '):
-        move = game_session.parse_move(move_str)
-        game_session.board.push(move)
-    return game_session.board
+    '''
+    Given a string of moves, return a chess.Board. Raises ValueError if the moves are invalid.
+    Any run of whitespace separates moves.
+    '''
+    board = _board_cache.get(moves)
+    if board is not None:
+        _board_cache.move_to_end(moves)
+        return board.copy() # Copies, so the caller can't change the cached board
+    # Start from the longest cached prefix of the moves, if any
+    board = None
+    remaining = moves
+    end = len(moves)
+    while (end := moves.rfind(' ', 0, end)) > 0:
+        prefix_board = _board_cache.get(moves[:end])
+        if prefix_board is not None:
+            board = prefix_board.copy()
+            remaining = moves[end + 1:]
+            break
+    if board is None:
+        board = Board()
+    # Push the moves straight onto the board; push_san accepts UCI as well as SAN, and raises a ValueError subclass for bad moves.
+    # (No need for a whole GameSession just to parse them.)
+    push_san = board.push_san
+    for move_str in remaining.replace('х', 'x').split():
+        push_san(move_str)
+    _board_cache[moves] = board.copy()
+    if len(_board_cache) > MOVES_TO_BOARD_CACHE_SIZE:
+        _board_cache.popitem(last=False)
+    return board
 
 def moves_to_fen(moves: str) -> str:
     '''Given a string of moves, return a FEN string'''
@@ -58,7 +84,9 @@ class ClientGameSession(GameSession):
     game_options includes the options that are relevant to both the client and the engine; see the GameSession class for details.
     client_options includes only the options that are relevant to the client; see the ClientOptions class for details.
     '''
-    def __init__(self, client_options: ClientOptions, fen: str = None, moves: list[str] = [], game_options: dict[str, Any] = DEFAULT_GAME_OPTIONS, session_id: Snowflake = None):
+    __slots__ = ('client_options', '_flavor_state', '_legal_moves_san', '_turn_players', '_render_san', 'ws')
+
+    def __init__(self, client_options: ClientOptions, fen: str = None, moves: list[str] | str = None, game_options: dict[str, Any] = None, session_id: Snowflake = None):
         '''
         Create a new ClientGameSession.
         :param ClientOptions client_options: The options that are relevant to the client.
@@ -66,27 +94,28 @@ class ClientGameSession(GameSession):
         :param list[str] moves: The moves to make in the game. Overrides the FEN string if both are present.
         :param dict[str, Any] game_options: The options that are relevant to both the client and the engine.
         :param Snowflake session_id: The session ID to use for the game. Should match the thread ID.
+        Construction never touches the network; use create() to also connect to the engine for games against it.
         '''
         # session_id is converted to string because Snowflake is not JSON serializable.
         # Also GameSession really shouldn't have to deal with Snowflake objects; those are Discord-specific.
         # TODO: figure out what happens if the session ID is not provided.
         super().__init__(fen=fen, moves=moves, game_options=game_options, session_id=str(session_id))
         self.client_options: ClientOptions = client_options
-        self.flavor_state = {
-            # Various state information for providing more fun flavor text
-            'spectators': [], # Discord IDs of spectators
-            'interlopers': {}, # Discord IDs of players who have attempted to join the game but are not allowed to, mapped to flavor text generators (TODO)
-        }
-        # If the game is vs the engine, connect to the engine
-        if self.client_options.players == 1:
-            # TODO: sort out once and for all whether session_id comes from the engine or the client.
-            # Also stop coding this late at night.
-            # For now I'm going to assume that the client generates the session ID and sends it to the engine.
-            # The engine will then send the session ID back to the client.
-            # The client will then send the session ID to the engine when it makes a move.
-            # This is ridiculous. I'm going to bed.
-            self.ws = None
-            asyncio.run(self.connect()) # Is this the right way to do this?
+        # The notation is fixed for the whole game, so decide once how the board is rendered
+        self._render_san: bool = client_options.notation == 'san'
+        # Created on first use by the flavor_state property, since most games never need it
+        self._flavor_state: dict[str, Any] | None = None
+        # Sorted SAN legal moves for the last position they were requested for, keyed by that position
+        self._legal_moves_san: tuple[Any, list[str]] | None = None
+        # IDs, names and mentions of the current and other player looked up so far, keyed by the side to move they were looked up for
+        self._turn_players: tuple[Color, dict[str, str]] | None = None
+        # Engine connection, for games vs the engine. It's opened by create() on the bot's own event loop;
+        # it used to be opened here with asyncio.run, which can't run inside the bot's loop and would block it even if it could.
+        # TODO: sort out once and for all whether session_id comes from the engine or the client.
+        # For now I'm going to assume that the client generates the session ID and sends it to the engine.
+        # The engine will then send the session ID back to the client.
+        # The client will then send the session ID to the engine when it makes a move.
+        self.ws = None
         # Offer state can be a single Offer, since only one offer can be active at a time.
     
     def __str__(self):
@@ -103,36 +132,70 @@ class ClientGameSession(GameSession):
         client_options = str(self.client_options)
         return f'GameSession({author_name}, {opponent_name}, {name}, {moves}, {client_options})'
     
+    @property
+    def flavor_state(self) -> dict[str, Any]:
+        '''Various state information for providing more fun flavor text.'''
+        if self._flavor_state is None:
+            self._flavor_state = {
+                'spectators': [], # Discord IDs of spectators
+                'interlopers': {}, # Discord IDs of players who have attempted to join the game but are not allowed to, mapped to flavor text generators (TODO)
+            }
+        return self._flavor_state
+
+    def _turn_value(self, key: str, current: bool, lookup: Callable[[Color], str]) -> str:
+        '''
+        Look up a value for the current (or other) player with the given ClientOptions method, remembering it until the turn changes.
+        Only the values that are actually asked for are looked up.
+        '''
+        turn = self.board.turn
+        if self._turn_players is None or self._turn_players[0] != turn:
+            self._turn_players = (turn, {})
+        values = self._turn_players[1]
+        if key not in values:
+            values[key] = lookup(turn if current else not turn)
+        return values[key]
+
     @property
     def current_player_id(self) -> Snowflake:
         '''The ID of the player whose turn it is.'''
-        return self.client_options.get_id(self.board.turn)
+        return self._turn_value('current_id', True, self.client_options.get_id)
 
     @property
     def other_player_id(self) -> Snowflake:
         '''The ID of the player whose turn it is not.'''
-        return self.client_options.get_id(not self.board.turn)
+        return self._turn_value('other_id', False, self.client_options.get_id)
 
     @property
     def current_player_name(self) -> str:
         '''The name of the player whose turn it is.'''
-        return self.client_options.get_nick(self.board.turn)
+        return self._turn_value('current_name', True, self.client_options.get_nick)
     
     @property
     def other_player_name(self) -> str:
         '''The name of the player whose turn it is not.'''
-        return self.client_options.get_nick(not self.board.turn)
+        return self._turn_value('other_name', False, self.client_options.get_nick)
     
     @property
     def current_player_mention(self) -> str:
         '''The mention (nickname or ping, depending on options) of the player whose turn it is.'''
-        return self.client_options.get_ping_or_nick(self.board.turn)
+        return self._turn_value('current_mention', True, self.client_options.get_ping_or_nick)
     
     @property
     def other_player_mention(self) -> str:
         '''The mention (nickname or ping, depending on options) of the player whose turn it is not.'''
-        return self.client_options.get_ping_or_nick(not self.board.turn)
+        return self._turn_value('other_mention', False, self.client_options.get_ping_or_nick)
     
+    def legal_moves_san(self) -> list[str]:
+        '''
+        The legal moves in the current position in SAN, sorted alphabetically (case-insensitive).
+        Cached until the position changes, since generating SAN means a legality check per move.
+        '''
+        key = self.board._transposition_key()
+        if self._legal_moves_san is None or self._legal_moves_san[0] != key:
+            moves_san = sorted((self.board.san(move) for move in self.board.legal_moves), key=str.casefold)
+            self._legal_moves_san = (key, moves_san)
+        return self._legal_moves_san[1]
+
     def new_game(self):
         '''
         Start a new game.
@@ -169,7 +232,7 @@ class ClientGameSession(GameSession):
             move = self.parse_move(move_str)
 
         except (InvalidMoveError, IllegalMoveError):
-            suggestions = correct_bad_move(move_str, self.board)
+            suggestions = correct_bad_move(move_str, self.board, self.legal_moves_san())
             if suggestions and len(suggestions) > 1:
                 return f'Invalid move \'**{move_str}**\'! Did you mean one of these? [**{"**, **".join(suggestions)}**]'
             elif suggestions and len(suggestions) == 1:
@@ -214,22 +277,24 @@ class ClientGameSession(GameSession):
         ret_str = ''
 
         # Convert the board to emoji, sending the list of SAN-formatted moves if the notation is SAN
-        if self.client_options.notation == 'san':
-            ret_str += board_to_emoji(self.board, self.moves)
-        elif self.client_options.notation == 'uci':
-            ret_str += board_to_emoji(self.board)
+        # (otherwise board_to_emoji lists the moves in UCI)
+        ret_str += board_to_emoji(self.board, self.moves if self._render_san else None)
 
         # Add any game state info from the last move
         if check_warning_result:
             ret_str += f'\n**{check_warning_result}**'
 
-        if self.is_game_over:
-            if self.is_checkmate:
+        # Work out how the game ended (if it did) in one pass, rather than asking the board about each ending in turn
+        outcome = self.board.outcome()
+        if outcome is not None or self.status.outcome != 'in_progress':
+            two_player = self.client_options.players == 2
+            termination = outcome.termination if outcome is not None else None
+            if termination == Termination.CHECKMATE:
                 winner = self.other_player_mention # The player who just moved is the winner
                 loser = self.current_player_mention # The player whose turn it is now is the loser
-                ret_str += f'\n{next(checkmate_2p if self.client_options.players == 2 else checkmate_1p).format(winner=winner, loser=loser)}'
-            elif self.is_stalemate:
-                ret_str += f'\n{next(stalemate_2p if self.client_options.players == 2 else stalemate_1p)}'
+                ret_str += f'\n{next(checkmate_2p if two_player else checkmate_1p).format(winner=winner, loser=loser)}'
+            elif termination == Termination.STALEMATE:
+                ret_str += f'\n{next(stalemate_2p if two_player else stalemate_1p)}'
             # No need to do anything else; caller will check if the game is over as well
 
         else: # If it's not game over, maybe ping the next player
@@ -259,6 +324,17 @@ class ClientGameSession(GameSession):
                 return f'**{offer_author.nick or offer_author.user.username}** accepted the draw offer from **{self.current_offer.offer_author.nick or self.current_offer.offer_author.user.username}**!'
             
 
+    @classmethod
+    async def create(cls, *args, **kwargs) -> 'ClientGameSession':
+        '''
+        Create a new ClientGameSession (taking the same arguments as the constructor), and connect to the engine if the game is vs the engine.
+        Use this instead of the constructor from inside the bot, so the connection is made on the running event loop.
+        '''
+        game_session = cls(*args, **kwargs)
+        if game_session.client_options.players == 1:
+            await game_session.connect()
+        return game_session
+
     def send_move(self, move_str: str) -> None:
         '''
         Send a move to the engine.
@@ -1,9 +1,10 @@
 # Provides a set of utility functions for the client.
 
+import asyncio
 import re
-import datetime
 import inspect
-from functools import wraps
+import time
+from functools import lru_cache, wraps
 import logging
 
 from interactions import Snowflake, Client
@@ -11,12 +12,21 @@ from interactions.api.models.channel import Channel
 from interactions.api.models.message import Message, MessageType
 from interactions.api.models.user import User
 from interactions.utils.get import get
-from chess import Piece, Board
+from chess import SQUARES, SQUARES_180, STARTING_BOARD_FEN, Piece, Board, square_file, square_rank
 
 from config import BOT_ID
 
 logger = logging.getLogger(__name__)
 
+# Number of digits in a snowflake id
+_SNOWFLAKE_LENGTH = 18
+# Matches anything that looks vaguely like a list of moves. More robust move parsing is done elsewhere.
+# The possessive quantifiers (++, *+) never give characters back, which keeps backtracking bounded on long non-matching input.
+# TODO: define all the regexes in one place, to make it easier to update them for new features (e.g. variants)
+_CHESSLIKE_RE = re.compile(r'(?:\d+\. *(?:[KQRBNOa-hx][\w=+#]++ *+(?:[0\-1/]*+)?){1,2} *+){1,}')
+# Matches a single move within a list of moves matched by _CHESSLIKE_RE
+_MOVE_TOKEN_RE = re.compile(r'[KQRBNOa-hx][\w=+#]+')
+
 # Map pieces to emoji names
 pieces_map = {
     'P': 'pw',
@@ -34,15 +44,38 @@ pieces_map = {
     '.': '__'
 }
 
+# Map pieces to emoji names without going through their symbols
+_piece_names = {Piece.from_symbol(symbol): name for symbol, name in pieces_map.items() if symbol != '.'}
+# Shade suffix of each square's emoji ('l' for light, 'd' for dark), indexed by square (a1 = 0, h8 = 63)
+_SQUARE_SHADES = tuple('l' if (square_rank(square) + square_file(square)) % 2 else 'd' for square in SQUARES)
+# Squares of each rank in the order they're drawn, top (rank 8) to bottom, each left to right (SQUARES_180 is already in that order)
+_RANK_SQUARES = tuple(tuple(SQUARES_180[i:i + 8]) for i in range(0, 64, 8))
+
 # Map emoji names to emoji references, e.g. 'pw' -> '<:pw:1084899251366133802>'
 # Must be initialized after the bot is logged in, since the emoji IDs change whenever the server's emojis are updated
 # TODO: just use a single map for both pieces_map and emoji_map, this is silly
 emoji_map = {}
+# Emoji reference for each (piece or None for an empty square, shade suffix) pair, rebuilt from emoji_map by populate_emoji_map
+_square_emoji: dict[tuple[Piece | None, str], str] = {}
+
+# Rendered starting position, which every new game sends and which only changes when emoji_map does
+_starting_board_emoji: str | None = None
 
 def populate_emoji_map(new_map: dict[str, str]):
     '''Populate emoji_map with the current emoji references.'''
-    for piece, emoji in new_map.items():
-        emoji_map[piece] = emoji
+    global _starting_board_emoji, _square_emoji
+    # on_ready fires again on every reconnect, usually with the same map as before
+    if new_map == emoji_map:
+        return
+    emoji_map.update(new_map)
+    # Resolve every square's emoji up front, so rendering a square is a single lookup
+    _square_emoji = {
+        (piece, shade): emoji_map[name + shade]
+        for piece, name in [(None, '__'), *_piece_names.items()]
+        for shade in ('l', 'd', 'h')
+        if name + shade in emoji_map
+    }
+    _starting_board_emoji = None
     logger.debug(f'Populated emoji_map in client_utils.py: {emoji_map}')
 
 def fen_to_emoji(fen: str) -> str:
@@ -66,35 +99,47 @@ def board_to_emoji(board: Board, moves_list: list[str] = None) -> str:
     Not quite like that, each emoji will be a fully-qualified reference, e.g. <:pwl:1084899251366133802>,
     but that would be too long for this comment.
     '''
+    global _starting_board_emoji
     # If emoji_map is empty, error out
-    if len(emoji_map) == 0:
+    if not _square_emoji:
         raise ValueError('emoji_map is empty, please call populate_emoji_map(new_map) first')
+    # The starting position with no moves always renders the same, so only build it once
+    is_starting_board = not moves_list and not board.move_stack and board.board_fen() == STARTING_BOARD_FEN
+    if is_starting_board and _starting_board_emoji is not None:
+        return _starting_board_emoji
     # If moves_list is None, try to get the moves from the board
     if moves_list is None:
         moves_list = [move.uci() for move in board.move_stack]
-    # Get the last move, if any
-    last_move = board.peek() if len(board.move_stack) > 0 else None
+    # Get the squares of the last move, if any, for highlighting
+    last_move = board.peek() if board.move_stack else None
+    from_square, to_square = (last_move.from_square, last_move.to_square) if last_move else (-1, -1)
     # Get a string representation of the moves list
     if len(moves_list) == 0:
         moves_str = ''
     else:
-        # Add move numbers every other move, and with the last move wrapped with '**'
-        moves_str = ''.join([(f'  {i // 2 + 1}. ' if i % 2 == 0 else ' ') + f'{"**" if i == len(moves_list) - 1 else ""}{move}' for i, move in enumerate(moves_list)]) + '**'
-    # Get a representation of the board as a 2D array
-    board_str = str(board)
-    board_arr = [rank.split(' ') for rank in board_str.split('\n')]
-    # Isolate the relevant squares from the last move, if any, for highlighting
-    (fr, ff, tr, tf) = (7 - last_move.from_square // 8, last_move.from_square % 8, 7 - last_move.to_square // 8, last_move.to_square % 8) if last_move else (None, None, None, None)
-    # Convert to a 2D array of emoji names
-    board_arr = [[f'{pieces_map[board_arr[r][f]]}{"h" if ((r == fr and f == ff) or (r == tr and f == tf)) else ("l" if (r + f) % 2 == 0 else "d")}' for f in range(len(board_arr[r]))] for r in range(len(board_arr))]
-    # Convert the board array into a list of strings, each string representing a rank
-    ranks_arr = [' ' + ''.join([emoji_map[p] for p in board_arr[r]]) + f' `{8-r}`' for r in range(len(board_arr))]
-    # Add the move list as an initial string
-    ranks_arr.insert(0, moves_str)
+        # Lay the moves out with a move number before every other move and a space before the rest,
+        # with the last move wrapped with '**'
+        parts = [' '] * (2 * len(moves_list))
+        parts[0::4] = [f'  {number}. ' for number in range(1, (len(moves_list) + 1) // 2 + 1)]
+        parts[1::2] = moves_list
+        parts[-1] = f'**{moves_list[-1]}**'
+        moves_str = ''.join(parts)
+    # Look up each occupied square's piece once, rather than parsing str(board)
+    piece_map = board.piece_map()
+    # Build each rank's line straight from emoji names, starting with the move list
+    ranks_arr = [moves_str]
+    for rank, squares in zip(range(8, 0, -1), _RANK_SQUARES):
+        ranks_arr.append(' ' + ''.join(
+            _square_emoji[piece_map.get(square), 'h' if square == from_square or square == to_square else _SQUARE_SHADES[square]]
+            for square in squares
+        ) + f' `{rank}`')
     # Add the file labels as a final string
     ranks_arr.append('` a  b  c  d  e  f  g  h  `')
     # Join the lines into a single string and return it
-    return '\n'.join(ranks_arr)
+    board_emoji = '\n'.join(ranks_arr)
+    if is_starting_board:
+        _starting_board_emoji = board_emoji
+    return board_emoji
 
 def emoji_to_fen(emoji: str) -> str:
     '''Given a string that can be used in a Discord message, return a FEN string'''
@@ -107,16 +152,16 @@ def emoji_to_board(message_str: str) -> Board:
     '''Given a string that can be used in a Discord message, return a chess.Board'''
     # Create a new empty board
     board = Board(fen=None)
+    # Split the message into lines once, and trim the list from there
+    lines = message_str.split('\n')
     # Discard the first line (the move list) if it exists (starts with '1. ')
-    if message_str.split('\n')[0].startswith('1. '):
-        message_str = '\n'.join(message_str.split('\n')[1:])
+    if lines[0].startswith('1. '):
+        lines = lines[1:]
     # Discard the last line (the file labels) if it exists (starts with '` a ')
-    if message_str.split('\n')[-1].startswith('` a ') or message_str.split('\n')[-1].strip().startswith('a'):
-        message_str = '\n'.join(message_str.split('\n')[:-1])
-    # Discard the file labels at the end of each line if they exist
-    message_str = '\n'.join([line.strip().split(' ')[0] for line in message_str.split('\n')])
-    # Get the ranks from the emoji
-    ranks = message_str.split('\n')
+    if lines and (lines[-1].startswith('` a ') or lines[-1].strip().startswith('a')):
+        lines = lines[:-1]
+    # Get the ranks from the emoji, discarding the rank labels at the end of each line if they exist
+    ranks = [line.strip().split(' ', 1)[0] for line in lines]
     if len(ranks) != 8:
         print(f'Invalid number of ranks: {len(ranks)}')
         print(f'Ranks: {ranks}')
@@ -142,14 +187,6 @@ def to_discord_snowflake(id: str | int) -> Snowflake:
     Convert a string or an int to a Snowflake.
     Must be a valid Discord snowflake, or else a TypeError or ValueError will be raised.
     '''
-    # Define a regular expression for the snowflake id format.
-    # Catches ids with e.g. invalid characters, too many digits, or too few digits.
-    snowflake_pattern = re.compile(r"^\d{18}$")
-
-    # Define constant for Discord's epoch.
-    # Discord uses a custom epoch that makes it easy to distinguish between Discord snowflakes and others (e.g. Twitter's).
-    DISCORD_EPOCH = 1420070400000 # 2015-01-01 00:00:00
-
     # Check if it's already a Snowflake. If it is, just return it.
     if isinstance(id, Snowflake):
         return id
@@ -160,8 +197,10 @@ def to_discord_snowflake(id: str | int) -> Snowflake:
     elif not isinstance(id, str):
         raise TypeError(f"Could not validate snowflake: {id} is not a string or an int")
 
-    # Check if it matches the snowflake regex.
-    if not snowflake_pattern.match(id):
+    # Check if it's the right number of plain ASCII digits.
+    # Catches ids with e.g. invalid characters, too many digits, or too few digits.
+    # These are all C-level string checks, which beat running the regex engine on such a short string.
+    if not (len(id) == _SNOWFLAKE_LENGTH and id.isascii() and id.isdigit()):
         raise ValueError(f"Could not validate snowflake: {id} is not a valid snowflake id")
     
     # Convert it to int for further validation.
@@ -172,14 +211,10 @@ def to_discord_snowflake(id: str | int) -> Snowflake:
     if not (-2**63 <= id < 2**63):
         raise ValueError(f"Could not validate snowflake: {id} is out of range for a signed bigint")
     
-    # Extract the timestamp portion of the id by shifting left by 22 bits
-    timestamp = (id >> 22) + DISCORD_EPOCH
-
-    # Convert the timestamp to a datetime object
-    timestamp = datetime.datetime.fromtimestamp(timestamp / 1000)
-
-    # Check if it is after Discord's epoch
-    if timestamp < datetime.datetime(2015, 1, 1):
+    # Check if it is after Discord's epoch.
+    # The timestamp portion of the id (id >> 22) counts milliseconds since Discord's epoch (2015-01-01),
+    # so it can only fall before the epoch if the id itself is negative.
+    if id < 0:
         raise ValueError(f"Snowflake {id} has an invalid timestamp before Discord's epoch")
     
     # Return the Snowflake object
@@ -192,24 +227,17 @@ def validate_discord_snowflake(func):
     If the ID is not a valid Discord snowflake, a TypeError or ValueError will be raised.
     Works for both free functions and bound methods.
     '''
+    # Work out which argument holds the ID once, at decoration time, rather than on every call.
+    # Methods (and classmethods) take the ID as their second argument; free functions and static methods take it first.
+    params = list(inspect.signature(func).parameters)
+    id_index = 1 if params and params[0] in ('self', 'cls') else 0
+
     @wraps(func)
     def wrapper(*args, **kwargs):
-        # default for free functions and static methods
-        id_index = 0
-        # check if the function is a method.
-        # since this is a decorator, the wrapper itself will become a method in place of the original function, so we need to check the wrapper.
-        if hasattr(args[0], '__dict__') and inspect.ismethod(getattr(args[0], func.__name__, None)):
-            # check second argument
-            id_index = 1
-        else:
-            # check first argument
-            id_index = 0
-
-        # replace the id with a Snowflake, if it's not already one
+        # replace the id with a Snowflake, if it's not already one, splicing it straight into the call's arguments
         if not isinstance(args[id_index], Snowflake):
             id = to_discord_snowflake(args[id_index])
-            args = list(args)
-            args[id_index] = id
+            return func(*args[:id_index], id, *args[id_index + 1:], **kwargs)
 
         # call the original function
         return func(*args, **kwargs)
@@ -221,41 +249,83 @@ def get_moves(msg_str: str) -> str | None:
     '''
     Get the moves from a message.
     '''
-    # Define a regex that matches anything that looks vaguely like a list of moves
-    # More robust move parsing is done elsewhere
-    # TODO: define all the regexes in one place, to make it easier to update them for new features (e.g. variants)
-    chesslike_regex = r'(?:\d+\. *(?:[KQRBNOa-hx][\w=+#]+ *(?:[0\-1/]*)?){1,2} *){1,}'
-    # Isolate the string that contains the moves
-    try:
-        moves_str = re.search(chesslike_regex, msg_str)[0]
-    except TypeError:
+    # Messages without content (e.g. embeds only) can't contain moves
+    if not msg_str:
         return None
-    return moves_str
+    # Isolate the string that contains the moves
+    match = _CHESSLIKE_RE.search(msg_str)
+    return match[0] if match else None
+
+def sent_by_bot(msg: Message) -> bool:
+    '''
+    Check if a message was sent by this bot.
+    '''
+    # Should be able to use msg.author.id == BOT_ID, but I don't see __eq__ defined for Snowflake despite the docs saying it is, so we'll just compare the strings
+    return str(msg.author.id) == BOT_ID
 
 def contains_moves(msg: Message) -> bool:
     '''
     Check if a message contains a list of moves.
     '''
     # Ignore messages not sent by the bot
-    if msg.author.id != BOT_ID:
+    if not sent_by_bot(msg):
+        return False
+    # Every move list has a move number followed by a period, so skip the regex for messages without one
+    if not msg.content or '.' not in msg.content:
         return False
-    # Return true if the message contains a list of moves
-    return get_moves(msg.content) is not None
+    # Return true if the message contains a list of moves; only the match itself matters here, not the matched text
+    return _content_has_moves(str(msg.id), msg.content)
+
+@lru_cache(maxsize=4096)
+def _content_has_moves(msg_id: str, content: str) -> bool:
+    '''
+    Search a message's content for a list of moves, remembering the answer per message.
+    The history scans in get_last_moves and cleanup revisit the same recent messages over and over;
+    the content is part of the key so an edited message is searched again.
+    '''
+    return _CHESSLIKE_RE.search(content) is not None
+
+# Number of seconds to reuse a get_last_moves result for, to save repeated history fetches from the Discord API
+HISTORY_CACHE_TTL = 5
+# Maximum number of get_last_moves results to keep; the oldest is dropped first
+HISTORY_CACHE_MAX_SIZE = 256
+# Recent get_last_moves results, keyed by (channel ID, last message ID), with the time.monotonic() they were fetched at.
+# Any new message in the channel changes the key, so entries only need to expire to keep the dict small.
+_history_cache: dict[tuple[str, str], tuple[float, tuple[str, ...] | None]] = {}
+
+def forget_last_moves(channel_id: int | str | Snowflake):
+    '''Drop any cached get_last_moves results for a channel, e.g. once a game is registered there.'''
+    channel_id = str(channel_id)
+    for key in [k for k in _history_cache if k[0] == channel_id]:
+        del _history_cache[key]
 
-async def get_last_moves(channel: Channel) -> list[str]:
+async def get_last_moves(channel: Channel) -> list[str] | None:
     '''
     Get the last message in a channel that corresponds to a move in a chess game (i.e. a message that contains a list of moves).
+    Returns the moves in that message as a new list, or None if there isn't one.
     '''
+    now = time.monotonic()
+    key = (str(channel.id), str(channel.last_message_id))
+    cached = _history_cache.get(key)
+    if cached is not None and now - cached[0] < HISTORY_CACHE_TTL:
+        # The cache holds a tuple, so callers get their own list and can't change what later callers see
+        return None if cached[1] is None else list(cached[1])
+    # Drop expired entries while we're here
+    for expired_key in [k for k, (fetched_at, _) in _history_cache.items() if now - fetched_at >= HISTORY_CACHE_TTL]:
+        del _history_cache[expired_key]
     msg = await anext(channel.history(start_at=channel.last_message_id, maximum=100, reverse=True, check=contains_moves), None)
     if msg is None:
-        return None
-    # Get the moves from the message
-    moves_str = get_moves(msg.content)
-    # Remove the move numbers and split the string into a list of moves
-    moves_list = re.sub(r' *\d+\. *', ' ', moves_str).strip().split(' ')
-    # Remove empty strings
-    ret = [move for move in moves_list if move]
-    logger.debug(f'get_last_moves: Found moves: {ret}')
+        ret = None
+    else:
+        # Get the moves from the message
+        moves_str = get_moves(msg.content)
+        # Pick out the moves in a single pass, skipping move numbers and whitespace
+        ret = _MOVE_TOKEN_RE.findall(moves_str)
+        logger.debug(f'get_last_moves: Found moves: {ret}')
+    if len(_history_cache) >= HISTORY_CACHE_MAX_SIZE:
+        # Dicts keep insertion order, so the first key is the oldest entry
+        del _history_cache[next(iter(_history_cache))]
+    _history_cache[key] = (now, None if ret is None else tuple(ret))
     return ret
 
 async def cleanup(client: Client, msg_id: int | str | Snowflake, channel_id: Snowflake) -> bool:
@@ -264,35 +334,39 @@ async def cleanup(client: Client, msg_id: int | str | Snowflake, channel_id: Sno
     This includes deleting the "new game" message (which should match the ID), 
     deleting the thread (if it exists), and sending an ephemeral message to the user (which the caller handles).
     '''
-    # Get the channel
-    channel: Channel = await get(client=client, obj=Channel, object_id=channel_id)
-    # Get the message
-    target_msg: Message = await get(client=client, obj=Message, object_id=msg_id, channel_id=channel_id)
+    # Get the channel and the message; the message lookup only needs the channel ID, so both can be fetched at once
+    channel: Channel
+    target_msg: Message
+    channel, target_msg = await asyncio.gather(
+        get(client=client, obj=Channel, object_id=channel_id),
+        get(client=client, obj=Message, object_id=msg_id, channel_id=channel_id),
+    )
     # There seems to be some inconsistency in whether the THREAD_CREATED message is above or below the new game message,
-    # so we need to check both.
-    related_msg: Message = None
-    try:
-        # Get the message below the target message, filtering by the bot's ID
-        # Should be able to use msg.author.id == BOT_ID, but I don't see __eq__ defined for Snowflake despite the docs saying it is, so we'll just compare the strings
-        related_msg: Message = await anext(channel.history(start_at=msg_id, maximum=10, reverse=True, check=lambda msg: str(msg.author.id) == BOT_ID))
-    except StopAsyncIteration:
+    # so we need to check both. The two scans are independent, so run them at the same time.
+    # Get the messages below and above the target message, filtering by the bot's ID
+    below_task = asyncio.create_task(anext(channel.history(start_at=msg_id, maximum=10, reverse=True, check=sent_by_bot), None))
+    above_task = asyncio.create_task(anext(channel.history(start_at=msg_id, maximum=10, reverse=False, check=sent_by_bot), None))
+    # Prefer the message below the target message, as before, so once that's found there's no need to wait for the other scan
+    related_msg: Message = await below_task
+    if related_msg is not None:
+        above_task.cancel()
+    else:
         logger.debug("No message below the new game message")
-        pass
-    try:
-        # Get the message above the target message, filtering by the bot's ID, if we haven't found one yet
+        related_msg = await above_task
         if related_msg is None:
-            related_msg: Message = await anext(channel.history(start_at=msg_id, maximum=10, reverse=False, check=lambda msg: str(msg.author.id) == BOT_ID))
-    except StopAsyncIteration:
-        logger.debug("No message above the new game message (???)")
-        pass
+            logger.debug("No message above the new game message (???)")
+
+    async def delete_msg(msg: Message):
+        if msg.type == MessageType.THREAD_CREATED:
+            # Delete the thread
+            thread: Channel = await get(client=client, obj=Channel, object_id=msg.thread.id)
+            await thread.delete()
+        # Delete the message
+        await msg.delete()
+
     try:
-        for msg in (m for m in [target_msg, related_msg] if m is not None):
-            if msg.type == MessageType.THREAD_CREATED:
-                # Delete the thread
-                thread: Channel = await get(client=client, obj=Channel, object_id=msg.thread.id)
-                await thread.delete()
-            # Delete the message
-            await msg.delete()
+        # Delete the messages (and threads) concurrently rather than one round trip at a time
+        await asyncio.gather(*(delete_msg(m) for m in [target_msg, related_msg] if m is not None))
         return True
     except Exception as e:
         logger.error(f"Failed to delete messages: {e}")
@@ -1,42 +1,68 @@
 # game_manager.py
-# This used to be a dict, active_games, passed around all over the place, but now it's a singleton class.
-# Access the singleton instance of GameManager with game_manager.
+# This used to be a dict, active_games, passed around all over the place, but now it's a class with one shared instance.
+# Access the shared instance of GameManager with game_manager; don't construct another one.
 # Also supports serialization to JSON and loading from JSON.
+# Individual game changes are appended to a JSON Lines log, which is periodically compacted into a full snapshot.
 # Maybe there'll be some serialization manager later on, but for now, GameManager will handle it.
 
-import json
+import asyncio
+import atexit
 import logging
+import os
+import threading
+from io import BufferedWriter
+from typing import Any
 
+import orjson
 from interactions import Snowflake
 
-from config import ACTIVE_GAMES_CACHE_FILE
+from config import (ACTIVE_GAMES_CACHE_FILE, ACTIVE_GAMES_LOG_COMPACT_THRESHOLD,
+                    ACTIVE_GAMES_LOG_FILE, ACTIVE_GAMES_LOG_FLUSH_INTERVAL,
+                    ACTIVE_GAMES_SAVE_DELAY, CACHE_FILE_BUFFER_SIZE)
 
 from .client_session import ClientGameSession
+from .client_utils import forget_last_moves
 
 logger = logging.getLogger(__name__)
 
 '''
 Notes to self on serialization pipeline, just to lay it all out:
-- new_game calls GameManager.add_game()
-- GameManager.add_game() is decorated with validate_discord_snowflake() (should work now)
-- new_game is decorated with save_after()
-- save_after() calls GameManager.to_dict()
-
+- new_game calls GameManager.add_game(), which marks the game dirty
+- make_move calls GameManager.save_game() after a move, which marks the game dirty
+- ACTIVE_GAMES_SAVE_DELAY seconds after the first game is marked dirty, GameManager.save_dirty_games()
+  appends one 'update' record per dirty game to the log, however many times each one changed
+- GameManager.remove_game() appends a 'remove' record to the log (and un-marks the game if it was dirty)
+- Once the log holds ACTIVE_GAMES_LOG_COMPACT_THRESHOLD records, save_active_games() serializes GameManager.snapshot_dict(),
+  moves the log aside to ROTATED_LOG_FILE so new records start a fresh log, and writes the snapshot file from a worker thread
+- Once the snapshot is on disk, the rotated log is deleted, since the snapshot supersedes it
+- load_active_games() reads the snapshot, replays the rotated log (if a snapshot write didn't finish) and then the log
+  over it (last write wins), then compacts
+- Games that fail to load are kept in their serialized form and carried into every snapshot until a new game replaces them
 '''
 
+def _game_key(game_id: int | str | Snowflake) -> str:
+    '''
+    Normalize a game ID to the str form used for keys (the same form the JSON files use).
+    Most lookups already pass a str, which is returned as-is.
+    '''
+    return game_id if type(game_id) is str else str(game_id)
+
 class GameManager:
     '''
-    Singleton class to manage the active games.
+    Class to manage the active games. The module-level game_manager is the only instance the bot uses.
     Stores the active games in a dict, where the keys are the game IDs and the values are the ClientGameSession objects.
     Serializes itself to JSON and loads itself from JSON.
     '''
-    def __new__(cls):
-        if not hasattr(cls, 'instance'):
-            cls.instance: GameManager = super(GameManager, cls).__new__(cls)
-        return cls.instance
-
     def __init__(self):
         self._active_games: dict[str, ClientGameSession] = {}
+        # IDs of games that have changed since they were last recorded in the active games log
+        self._dirty: set[str] = set()
+        # Pending call to save_dirty_games, if one is scheduled
+        self._save_handle: asyncio.TimerHandle | None = None
+        # The state last recorded in the active games log for each game, so snapshots don't have to serialize every game again
+        self._logged_states: dict[str, dict[str, Any]] = {}
+        # Serialized games that couldn't be loaded, kept as-is so snapshots don't drop them
+        self._failed_games: dict[str, dict[str, Any]] = {}
 
     def __len__(self) -> int:
         '''Get the number of active games.'''
@@ -48,22 +74,26 @@ class GameManager:
     
     def __getitem__(self, key: int | str | Snowflake):
         '''Get a game from the active games.'''
-        key = str(key)
+        key = _game_key(key)
         return self._active_games[key]
     
     def __setitem__(self, key: int | str | Snowflake, value: ClientGameSession):
         '''Set a game in the active games.'''
-        key = str(key)
+        key = _game_key(key)
         self._active_games[key] = value
+        self._logged_states.pop(key, None)
+        # A new game in the channel supersedes one that failed to load there
+        self._failed_games.pop(key, None)
 
     def __delitem__(self, key: int | str | Snowflake):
         '''Delete a game from the active games.'''
-        key = str(key)
+        key = _game_key(key)
         del self._active_games[key]
+        self._logged_states.pop(key, None)
     
     def __contains__(self, key: int | str | Snowflake):
         '''Check if a game is in the active games.'''
-        key = str(key)
+        key = _game_key(key)
         return key in self._active_games
     
     def __repr__(self):
@@ -74,66 +104,281 @@ class GameManager:
         return self.__repr__()
 
     def add_game(self, game_id: int | str | Snowflake, game_session: ClientGameSession):
-        '''Add a game to the active games. If the game already exists, it will be overwritten. Also saves the active games to a JSON file.'''
-        self[game_id] = game_session
-        save_active_games()
+        '''Add a game to the active games. If the game already exists, it will be overwritten. Also records it in the active games log.'''
+        key = _game_key(game_id)
+        self[key] = game_session
+        self.save_game(key)
+        # The channel's move history now belongs to a live game, so don't serve an older scan of it
+        forget_last_moves(key)
 
-    def remove_game(self, game_id: str):
-        '''Remove a game from the active games. Also saves the active games to a JSON file.'''
-        del self[game_id]
-        save_active_games()
+    def remove_game(self, game_id: int | str | Snowflake):
+        '''Remove a game from the active games. Also records the removal in the active games log.'''
+        key = _game_key(game_id)
+        del self[key]
+        # Any pending update is superseded by the removal
+        self._dirty.discard(key)
+        append_log_record({'id': key, 'op': 'remove'})
+
+    def save_game(self, game_id: int | str | Snowflake):
+        '''
+        Mark a single game as changed. Its state is recorded in the active games log ACTIVE_GAMES_SAVE_DELAY seconds later,
+        so a burst of changes (e.g. several button presses) only serializes and logs it once.
+        '''
+        self._dirty.add(_game_key(game_id))
+        if self._save_handle is not None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Not running in the bot's event loop (e.g. at startup), so there's nothing to defer to
+            self.save_dirty_games()
+            return
+        self._save_handle = loop.call_later(ACTIVE_GAMES_SAVE_DELAY, self.save_dirty_games)
+
+    def save_dirty_games(self):
+        '''Record the current state of every game marked by save_game() in the active games log.'''
+        if self._save_handle is not None:
+            self._save_handle.cancel()
+            self._save_handle = None
+        dirty, self._dirty = self._dirty, set()
+        for game_id in dirty:
+            if game_id in self._active_games:
+                state = self._active_games[game_id].to_dict()
+                self._logged_states[game_id] = state
+                append_log_record({'id': game_id, 'op': 'update', 'state': state})
 
     def to_dict(self) -> dict[str, dict[str, ClientGameSession]]:
-        '''Convert the active games to a dict'''
-        return {k: v.to_dict() for k, v in self._active_games.items()}
+        '''Convert the active games to a dict, including any games that failed to load'''
+        return {**self._failed_games, **{k: v.to_dict() for k, v in self._active_games.items()}}
+
+    def snapshot_dict(self) -> dict[str, dict[str, Any]]:
+        '''
+        Like to_dict(), but reuses the state last recorded in the active games log for each game that hasn't changed since,
+        so only games that were never logged or are waiting to be logged get serialized again.
+        Games that failed to load are carried over unchanged, so compacting the log doesn't lose them.
+        '''
+        snapshot = dict(self._failed_games)
+        for k, v in self._active_games.items():
+            snapshot[k] = self._logged_states[k] if k in self._logged_states and k not in self._dirty else v.to_dict()
+        return snapshot
     
-# Get the singleton instance of GameManager
+# The shared instance of GameManager
 game_manager: GameManager = GameManager()
 
-def save_after(func):
-    '''Decorator to add a task to save the active games to a JSON file after the decorated coroutine is called.'''
-    async def wrapper(*args, **kwargs):
-        result = await func(*args, **kwargs)
+# Number of records appended to the log since the snapshot was last written
+_log_record_count = 0
+# Long-lived append handle for the active games log, opened on first use so each record doesn't pay for an open() and close()
+_log_file: BufferedWriter | None = None
+# Pending call to flush the log, if one is scheduled
+_log_flush_handle: asyncio.TimerHandle | None = None
+# Flushes can run in a worker thread, so they must not race with closing the handle
+_log_lock = threading.Lock()
+# Where the log is moved while the snapshot that supersedes it is being written
+ROTATED_LOG_FILE = ACTIVE_GAMES_LOG_FILE + '.old'
+# Snapshot write running in a worker thread, if any
+_snapshot_future: asyncio.Future | None = None
+# Whether another snapshot was requested while one was being written
+_snapshot_pending = False
+
+def flush_active_games_log():
+    '''Flush any buffered log records to disk.'''
+    with _log_lock:
+        if _log_file is not None:
+            _log_file.flush()
+
+def close_active_games_log():
+    '''Flush and close the active games log handle. It will be reopened by the next append.'''
+    global _log_file, _log_flush_handle
+    if _log_flush_handle is not None:
+        _log_flush_handle.cancel()
+        _log_flush_handle = None
+    with _log_lock:
+        if _log_file is not None:
+            # Closing also flushes the buffer
+            _log_file.close()
+            _log_file = None
+
+# Make sure buffered records make it to disk on a clean shutdown
+atexit.register(close_active_games_log)
+# atexit runs handlers in reverse order, so pending game updates are logged before the log is closed
+atexit.register(game_manager.save_dirty_games)
+
+def _schedule_log_flush():
+    '''Flush the log after ACTIVE_GAMES_LOG_FLUSH_INTERVAL seconds, so a burst of records shares one write.'''
+    global _log_flush_handle
+    if _log_flush_handle is not None:
+        return
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        # Not running in the bot's event loop (e.g. at startup), so there's nothing to defer to
+        flush_active_games_log()
+        return
+    _log_flush_handle = loop.call_later(ACTIVE_GAMES_LOG_FLUSH_INTERVAL, _flush_log_in_background)
+
+def _flush_log_in_background():
+    '''Flush the log from a worker thread, so the disk write doesn't stall the event loop.'''
+    global _log_flush_handle
+    _log_flush_handle = None
+    asyncio.get_running_loop().run_in_executor(None, flush_active_games_log)
+
+def append_log_record(record: dict[str, Any]):
+    '''Append a single record to the active games log, compacting the log into a snapshot if it has grown too long.'''
+    global _log_record_count, _log_file
+    try:
+        if _log_file is None:
+            _log_file = open(ACTIVE_GAMES_LOG_FILE, 'ab', buffering=1 << 16)
+        _log_file.write(orjson.dumps(record) + b'\n')
+        _schedule_log_flush()
+    except Exception as e:
+        logger.error(f'Could not append to active games log: {e}')
+        logger.exception(e)
+        return
+    _log_record_count += 1
+    if _log_record_count >= ACTIVE_GAMES_LOG_COMPACT_THRESHOLD:
         save_active_games()
-        return result
-    return wrapper
 
-def save_active_games():
-    '''Save the active games to a JSON file'''
-    # Open the active_games JSON file
-    with open(ACTIVE_GAMES_CACHE_FILE, 'w') as f:
-        # Save the active games to the JSON file
+def _rotate_log():
+    '''Move the active games log aside, so that records appended from now on aren't covered by the snapshot being written.'''
+    # Closing also flushes anything still sitting in the write buffer
+    close_active_games_log()
+    if not os.path.exists(ROTATED_LOG_FILE):
         try:
-            json.dump(game_manager.to_dict(), f, indent=4)
-            logger.info('Active games saved to file')
-        except Exception as e:
-            logger.error(f'Could not save active games to file: {e}')
-            logger.exception(e)
+            os.replace(ACTIVE_GAMES_LOG_FILE, ROTATED_LOG_FILE)
+        except FileNotFoundError:
+            pass
+        return
+    # A previous snapshot write failed, so its rotated log is still needed; add this log onto the end of it
+    try:
+        with open(ACTIVE_GAMES_LOG_FILE, 'rb') as log, open(ROTATED_LOG_FILE, 'ab') as rotated:
+            rotated.write(log.read())
+        os.remove(ACTIVE_GAMES_LOG_FILE)
+    except FileNotFoundError:
+        pass
+
+def _write_snapshot(snapshot: bytes):
+    '''Write a serialized snapshot to the active games file, then delete the rotated log it supersedes. Blocks on disk I/O.'''
+    # Write to a temporary file and swap it in, so a crash mid-write can never leave a truncated snapshot behind
+    tmp_file = f'{ACTIVE_GAMES_CACHE_FILE}.{os.getpid()}.tmp'
+    try:
+        with open(tmp_file, 'wb', buffering=CACHE_FILE_BUFFER_SIZE) as f:
+            f.write(snapshot)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, ACTIVE_GAMES_CACHE_FILE)
+        logger.info('Active games saved to file')
+    except Exception as e:
+        logger.error(f'Could not save active games to file: {e}')
+        logger.exception(e)
+        try:
+            os.remove(tmp_file)
+        except FileNotFoundError:
+            pass
+        # Keep the rotated log, since it still holds changes the snapshot file is missing
+        return
+    try:
+        os.remove(ROTATED_LOG_FILE)
+    except FileNotFoundError:
+        pass
+
+def save_active_games():
+    '''
+    Save a snapshot of the active games to a JSON file, and retire the active games log, which the snapshot supersedes.
+    When called from the event loop, the file is written in a worker thread.
+    '''
+    global _log_record_count, _snapshot_future, _snapshot_pending
+    if _snapshot_future is not None and not _snapshot_future.done():
+        # Still writing the last snapshot; take another once it's done, however many requests pile up in the meantime
+        _snapshot_pending = True
+        return
+    _snapshot_pending = False
+    try:
+        # Serialize to a single buffer first so the whole snapshot goes out in one write(),
+        # and so a serialization error doesn't leave the old snapshot truncated
+        snapshot = orjson.dumps(game_manager.snapshot_dict(), option=orjson.OPT_INDENT_2)
+    except Exception as e:
+        logger.error(f'Could not serialize active games: {e}')
+        logger.exception(e)
+        # Keep the log, since it still holds changes the snapshot is missing
+        return
+    # Everything in the log up to this point is part of the snapshot
+    _rotate_log()
+    _log_record_count = 0
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        # Not running in the bot's event loop (e.g. at startup), so just write it here
+        _write_snapshot(snapshot)
+        return
+    _snapshot_future = loop.run_in_executor(None, _write_snapshot, snapshot)
+    _snapshot_future.add_done_callback(_on_snapshot_written)
+
+def _on_snapshot_written(future: asyncio.Future):
+    '''Take the snapshot that was requested while the last one was being written, if any. Runs on the event loop.'''
+    if _snapshot_pending:
+        save_active_games()
+
+def replay_log(game_dicts: dict[str, dict[str, Any]], log_file: str = ACTIVE_GAMES_LOG_FILE) -> int:
+    '''Apply the records in an active games log to the given serialized games, in order. Returns the number of records applied.'''
+    applied = 0
+    try:
+        with open(log_file, 'rb', buffering=CACHE_FILE_BUFFER_SIZE) as f:
+            for line in f:
+                try:
+                    record = orjson.loads(line)
+                except orjson.JSONDecodeError:
+                    # Most likely a partial last line from a crash mid-write
+                    logger.warning('Skipping invalid record in active games log')
+                    continue
+                if record['op'] == 'update':
+                    game_dicts[record['id']] = record['state']
+                elif record['op'] == 'remove':
+                    game_dicts.pop(record['id'], None)
+                applied += 1
+    except FileNotFoundError:
+        pass
+    return applied
 
 def load_active_games() -> bool:
-    '''Load the active games from the active_games JSON file'''
+    '''Load the active games from the active_games JSON file, then apply any changes recorded in the active games log'''
+    game_dicts: dict[str, dict[str, Any]] = {}
     try:
         # Open the active_games JSON file
-        with open(ACTIVE_GAMES_CACHE_FILE, 'r') as f:
+        with open(ACTIVE_GAMES_CACHE_FILE, 'rb', buffering=CACHE_FILE_BUFFER_SIZE) as f:
 
             # Load the JSON file
             try:
-                active_games = json.load(f)
-            except json.decoder.JSONDecodeError:
-                # If the JSON file is empty (or invalid), return False so the calling function can create it
-                logger.warning('Could not load active games from file; starting with no active games')
-                return False
-            
-            # Convert the JSON objects to ClientGameSession objects
-            for game_id_str, game_dict in active_games.items():
-                active_games[Snowflake(game_id_str)] = ClientGameSession.from_dict(game_dict)
-            logger.info('Active games loaded from file')
-
-            # Set the active games to the loaded active games
-            game_manager._active_games = active_games
-            return True
-        
+                game_dicts = orjson.loads(f.read())
+            except orjson.JSONDecodeError:
+                # If the JSON file is empty (or invalid), fall back to whatever the log has
+                logger.warning('Could not load active games from file')
+
     except FileNotFoundError:
-        # If the file does not exist, return False so the calling function can create it
-        logger.warning('Active games file not found; starting with no active games')
+        logger.warning('Active games file not found')
+
+    # A rotated log only survives if the snapshot that superseded it wasn't written, so it goes first
+    records = replay_log(game_dicts, ROTATED_LOG_FILE) + replay_log(game_dicts)
+    if not game_dicts and not records:
+        # Nothing to load, so return False so the calling function can create it
+        logger.warning('No saved active games; starting with no active games')
         return False
+
+    # Convert the JSON objects to ClientGameSession objects one at a time, so one bad game doesn't stop the rest from loading
+    active_games: dict[str, ClientGameSession] = {}
+    failed_games: dict[str, dict[str, Any]] = {}
+    for game_id_str, game_dict in game_dicts.items():
+        try:
+            active_games[game_id_str] = ClientGameSession.from_dict(game_dict)
+        except Exception as e:
+            logger.error(f'Could not load active game {game_id_str}: {e}')
+            logger.exception(e)
+            # Hang on to the raw state, so it survives compaction and can be recovered by hand
+            failed_games[game_id_str] = game_dict
+    game_manager._active_games = active_games
+    game_manager._failed_games = failed_games
+    logger.info('%d active games loaded from file (%d records replayed from log)', len(active_games), records)
+
+    # Fold the replayed records into a fresh snapshot (games that failed to load are carried over as-is)
+    if records:
+        save_active_games()
+    return True
@@ -2,12 +2,15 @@
 
 import logging
 from asyncio import sleep
+from functools import lru_cache
 from pprint import pformat
 
 import interactions
+import orjson
 from interactions.api.models import Channel
 from interactions.utils import autodefer, get
 
+from client import populate_emoji_map
 from config import EMOJI_CACHE_FILE, HOME_GUILD_ID
 
 from .command_definitions import commands
@@ -15,6 +18,14 @@ from .command_utils import refresh_emoji_names, admin_channel_only
 
 logger = logging.getLogger(__name__)
 
+# Leaves room for the code block markers within Discord's 2000 character message limit
+EVAL_RESULT_MAX_LENGTH = 1900
+
+@lru_cache(maxsize=128)
+def _compile_expression(expression: str):
+    '''Compile an expression for the eval command, caching the code object so repeated expressions skip the parser'''
+    return compile(expression, '<admin-eval>', 'eval')
+
 def register_admin_commands(client: interactions.Client):
 
     logger.info('Registering admin commands')
@@ -23,8 +34,15 @@ def register_admin_commands(client: interactions.Client):
 
     @client.command(**admin_commands['refresh_emoji_cache'])
     @admin_channel_only
-    async def _refresh_emoji_names(client: interactions.Client):
-        return refresh_emoji_names(client)
+    async def _refresh_emoji_names(ctx: interactions.CommandContext) -> None:
+        # refresh_emoji_names also replaces the cached map, so the next load_emoji_names call sees the new IDs.
+        # An explicit refresh always hits the API, since it's usually run right after the emoji changed.
+        emoji_map = await refresh_emoji_names(client, force=True)
+        if not emoji_map:
+            await ctx.send(content='Failed to refresh the emoji cache!')
+            return
+        populate_emoji_map(emoji_map)
+        await ctx.send(content=f'Emoji cache refreshed ({len(emoji_map)} emoji).')
     
     @client.command(**admin_commands['eval'])
     @autodefer()
@@ -38,9 +56,17 @@ def register_admin_commands(client: interactions.Client):
     async def _eval(ctx: interactions.CommandContext, expression: str) -> None:
         '''Evaluate the given code'''
         try:
-            result = pformat(await eval(expression))
+            result = await eval(_compile_expression(expression))
+            # Strings are already readable, so only pretty-print everything else
+            if not isinstance(result, str):
+                try:
+                    # Much faster than pformat for the usual dict and list results
+                    result = orjson.dumps(result, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS).decode('utf-8')
+                except TypeError:
+                    # Not JSON-serializable, so fall back to pformat
+                    result = pformat(result)
             logger.warning(f'Evaluated code: {expression} -> {result}')
-            await ctx.send(content=f'```{result}```')
+            await ctx.send(content=f'```{result[:EVAL_RESULT_MAX_LENGTH]}```')
         except Exception as e:
             logger.error(f'Exception while evaluating code: {e}')
             logger.exception(e)
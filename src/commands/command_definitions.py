@@ -2,16 +2,19 @@
 # Was originally JSON, but it"s a Python dict now because subsituting variables is easier.
 # Also might be easier to define options compatible with discord interactions.
 
+from types import MappingProxyType
+
 from interactions import Option, OptionType, Choice, Permissions
 
 from config import HOME_GUILD_ID, ADMIN_CHANNEL_ID
 
 SCOPE = int(HOME_GUILD_ID)
+ADMIN_CHANNEL = int(ADMIN_CHANNEL_ID)
 
 commands = {
     "admin_commands": {
-        "GUILD_ID": int(HOME_GUILD_ID),
-        "CHANNEL_ID": int(ADMIN_CHANNEL_ID),
+        "GUILD_ID": SCOPE,
+        "CHANNEL_ID": ADMIN_CHANNEL,
         "ping": {
             "name": "ping",
             "description": "Ping the bot."
@@ -55,7 +58,7 @@ commands = {
         }
     },
     "game_commands": {
-        "GUILD_ID": int(HOME_GUILD_ID),
+        "GUILD_ID": SCOPE,
         "CHANNEL_ID": None,
         "new": {
             "name": "new",
@@ -285,7 +288,7 @@ commands = {
         }
     },
     "user_commands": {
-        "GUILD_ID": int(HOME_GUILD_ID),
+        "GUILD_ID": SCOPE,
         "CHANNEL_ID": None,
         "help": {
             "name": "help",
@@ -306,4 +309,7 @@ commands = {
             "scope": SCOPE,
         },
     }
-}
\ No newline at end of file
+}
+
+# The definitions are read-only config, so expose them through read-only views to catch accidental mutation
+commands = MappingProxyType({group: MappingProxyType(group_commands) for group, group_commands in commands.items()})
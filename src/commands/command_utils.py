@@ -1,54 +1,107 @@
-import json
+import asyncio
 import logging
+import time
 from functools import wraps
 from pprint import pformat
 from datetime import datetime, timedelta
 
 import interactions
+import orjson
 
-from config import EMOJI_CACHE_FILE, HOME_GUILD_ID
+from config import CACHE_FILE_BUFFER_SIZE, EMOJI_CACHE_FILE, HOME_GUILD_ID
 
 from .command_definitions import commands
 
 logger = logging.getLogger(__name__)
 
+# Parsed contents of EMOJI_CACHE_FILE, so it only has to be read from disk once per process.
+# refresh_emoji_names writes through to this as well, so it never goes stale.
+_emoji_map_cache: dict[str, str] | None = None
+# Minimum number of seconds between two emoji list requests to the Discord API
+EMOJI_REFRESH_TTL = 5 * 60
+# time.monotonic() of the last successful refresh, or None if there hasn't been one this session
+_last_emoji_refresh: float | None = None
+
+def load_emoji_names() -> dict[str, str] | None:
+    '''Load the emoji names from the emoji_map JSON file, or from memory if they've already been loaded'''
+    global _emoji_map_cache
+    if _emoji_map_cache is not None:
+        return _emoji_map_cache
+    # Open the emoji_map JSON file
+    try:
+        with open(EMOJI_CACHE_FILE, 'rb', buffering=CACHE_FILE_BUFFER_SIZE) as f:
+            # Load the JSON file
+            _emoji_map_cache = orjson.loads(f.read())
+            logger.info('Emoji map loaded from file')
+            return _emoji_map_cache
+    except FileNotFoundError:
+        # If the file does not exist, return None so the calling function can create it via refresh_emoji_names
+        logger.warning('Emoji map file not found; querying Discord API for emoji IDs')
+        return None
+
+def _save_emoji_map(emoji_map: dict[str, str]):
+    '''Write the emoji map to the JSON file, unless it matches what's already saved. Blocks on disk I/O, so run it in a worker thread.'''
+    # Compare against what's already saved, since most refreshes don't change anything
+    saved_map = _emoji_map_cache
+    if saved_map is None:
+        try:
+            with open(EMOJI_CACHE_FILE, 'rb', buffering=CACHE_FILE_BUFFER_SIZE) as f:
+                saved_map = orjson.loads(f.read())
+        except (FileNotFoundError, orjson.JSONDecodeError):
+            saved_map = None
+    if emoji_map == saved_map:
+        logger.debug('Emoji map unchanged; not rewriting file')
+        return
+    # Serialize up front so the file is hit with a single write() instead of one per token
+    emoji_map_json = orjson.dumps(emoji_map, option=orjson.OPT_INDENT_2)
+    with open(EMOJI_CACHE_FILE, 'wb', buffering=CACHE_FILE_BUFFER_SIZE) as f:
+        f.write(emoji_map_json)
+        logger.debug('Saved emoji map to file')
+
 # Defined here so it can be imported by other modules
-async def refresh_emoji_names(client: interactions.Client) -> dict[str, str]:
-    '''Get a list of all the emoji names from the server and use them to populate emoji_map'''
+async def refresh_emoji_names(client: interactions.Client, force: bool = False) -> dict[str, str] | None:
+    '''
+    Get a list of all the emoji names from the server and use them to populate emoji_map. Returns None if the request fails.
+    Automatic refreshes are debounced; pass force=True to always query the API (e.g. when an admin asks for a refresh).
+    '''
+    global _emoji_map_cache, _last_emoji_refresh
+    # Discord doesn't support conditional requests for the emoji list, so debounce repeated refreshes instead
+    if not force and _emoji_map_cache is not None and _last_emoji_refresh is not None \
+            and time.monotonic() - _last_emoji_refresh < EMOJI_REFRESH_TTL:
+        logger.info('Emoji map was refreshed less than %d seconds ago; using cached map', EMOJI_REFRESH_TTL)
+        return _emoji_map_cache
     # Get the list of emoji from the server
-    emoji_map = {}
     try:
         emoji_list = await client._http.get_all_emoji(int(HOME_GUILD_ID))
     except interactions.HTTPException as e:
         logger.error(f'Failed to get emoji list from Discord API: {e} {e.response}')
-        return False
-    # Iterate over the emoji
-    for emoji in emoji_list:
-        # Get the emoji name
-        emoji_name = emoji['name']
-        # Add the emoji name to the map
-        emoji_map[emoji_name] = f'<:{emoji_name}:{emoji["id"]}>'
-        logger.debug(f'Added emoji {emoji_name} to map with id {emoji["id"]}')
-    # Save the emoji map to the JSON file
-    with open(EMOJI_CACHE_FILE, 'w') as f:
-        json.dump(emoji_map, f, indent=4)
-        logger.debug('Saved emoji map to file')
+        return None
+    # Map each emoji name to its full reference, e.g. 'pwl' -> '<:pwl:1084899251366133802>'
+    emoji_map = {emoji['name']: f'<:{emoji["name"]}:{emoji["id"]}>' for emoji in emoji_list}
+    # One message for the whole map, rather than one per emoji
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug('Added %d emoji to map: %s', len(emoji_map), ', '.join(emoji_map.values()))
+    # Save the emoji map to the JSON file, off the event loop
+    await asyncio.to_thread(_save_emoji_map, emoji_map)
+    _emoji_map_cache = emoji_map
+    _last_emoji_refresh = time.monotonic()
     return emoji_map
 
+# Converted once here rather than on every admin command invocation
+_ADMIN_CHANNEL_ID = int(commands['admin_commands']['CHANNEL_ID'])
+
 def admin_channel_only(func):
     '''Decorator to check if a command is used in the admin channel'''
     @wraps(func)
-    async def wrapper(*args, **kwargs):
-        # Get the context from the arguments
-        ctx = args[0]
+    async def wrapper(ctx, *args, **kwargs):
         # Check for type safety, and if it's not there, log an error
         if not isinstance(ctx, interactions.CommandContext):
             logger.error(f'admin_channel_only decorator called with invalid context: {pformat(ctx)}')
             return
         # Check if the command was used in the admin channel
-        if ctx.channel_id == int(commands['admin_commands']['CHANNEL_ID']):
+        if ctx.channel_id == _ADMIN_CHANNEL_ID:
             # If so, call the function
-            return await func(*args, **kwargs)
+            return await func(ctx, *args, **kwargs)
         else:
             # If not, send an error message
             await ctx.send(content='Sorry, this command can only be used in the admin channel!', ephemeral=True)
@@ -2,22 +2,30 @@
 
 import logging
 import random
-from base64 import b64decode, b64encode
-from json import dumps, loads
+from base64 import b64decode
 from chess import BLACK, WHITE
 
 import interactions
-from interactions import Button, ButtonStyle
-from interactions.utils.utils import spread_to_rows
+import orjson
+from interactions import ActionRow, Button, ButtonStyle
 
-from client import (ClientGameSession, ClientOptions, cleanup, game_manager,
-                    save_after)
+from client import ClientGameSession, ClientOptions, cleanup, game_manager
 from game import Player
 
 from .command_definitions import commands
 
 logger = logging.getLogger(__name__)
 
+# Button custom IDs are '<type>|<channel_id>|<value>', e.g. 'm|1084899251366133802|Nf3'.
+# SAN moves never contain '|', so the value can be split off safely.
+MOVE_BUTTON_PREFIX = 'm'
+# Discord allows at most 5 buttons in an action row
+BUTTONS_PER_ROW = 5
+
+def buttons_to_rows(buttons: list[Button]) -> list[ActionRow]:
+    '''Lay buttons out into action rows, filling each row before starting the next.'''
+    return [ActionRow(components=buttons[i:i + BUTTONS_PER_ROW]) for i in range(0, len(buttons), BUTTONS_PER_ROW)]
+
 def register_game_commands(client: interactions.Client):
     '''Implement and implicitly register game-related slash commands.'''
 
@@ -25,7 +33,8 @@ def register_game_commands(client: interactions.Client):
 
     async def new_game_pvp(ctx: interactions.CommandContext, vs_user: interactions.User, color: str = 'random', ranked: bool = True, time_control: str = None) -> interactions.Channel:
         author_nick = ctx.author.nick if ctx.author.nick else ctx.author.user.username
-        # Determine the opponent
+        # Determine the opponent.
+        # vs_user comes resolved from the interaction payload, so there's no need to fetch the member from the API for its nick.
         if vs_user is None:
             await ctx.send(content='Invalid opponent! Please mention a user.')
             return
@@ -59,7 +68,7 @@ def register_game_commands(client: interactions.Client):
         # TODO: load unspecified client options as user options from database
 
         # Create a new GameSession
-        game_session = ClientGameSession(client_options=client_options)
+        game_session = await ClientGameSession.create(client_options=client_options)
 
         # Register the session with the game manager
         game_manager.add_game(game_channel.id, game_session)
@@ -81,7 +90,6 @@ def register_game_commands(client: interactions.Client):
 
     # Decorators take care of registering the commands with the interactions library.
     @client.command(**commands['game_commands']['new'])
-    @save_after
     async def new_game(ctx: interactions.CommandContext, sub_command: str, vs: interactions.Member = None, level: str = 'random') -> None:        
         '''Create a new game.'''
         game_channel = None
@@ -139,7 +147,6 @@ def register_game_commands(client: interactions.Client):
         
         await make_move(ctx, game_session, move)
 
-    @save_after
     async def make_move(ctx: interactions.CommandContext | interactions.ComponentContext, game_session: ClientGameSession, move: str) -> None:
         '''Make a move in the current game.'''
         
@@ -148,6 +155,7 @@ def register_game_commands(client: interactions.Client):
             await ctx.send(content='Game is already over!')
             return
         # Make the move
+        moves_before = len(game_session.moves)
         response = game_session.make_move(move, ctx.author)
         # Send the response
         await ctx.send(content=response)
@@ -161,6 +169,9 @@ def register_game_commands(client: interactions.Client):
                 await ctx.send(content='Error locking thread!')
             # Remove the game from the list of active game
             game_manager.remove_game(ctx.channel_id)
+        elif len(game_session.moves) != moves_before:
+            # Only the game that moved needs to be written out
+            game_manager.save_game(ctx.channel_id)
     
     @client.command(**commands['game_commands']['moves'])
     async def moves(ctx: interactions.CommandContext) -> None:
@@ -169,31 +180,47 @@ def register_game_commands(client: interactions.Client):
         except KeyError:
             await ctx.send(content='No active game found in this channel!')
             return
-        moves_san = [game_session.board.san(move) for move in game_session.board.legal_moves]
-        moves_san.sort(key=str.casefold)
+        moves_san = game_session.legal_moves_san()
         if len(moves_san) > 0:
             # await ctx.send(content=f'Legal moves: **{"**, **".join(moves_san)}**')
-            buttons = [Button(style=ButtonStyle.SECONDARY, label=move, custom_id=b64encode(dumps({'type': 'move', 'channel_id': str(ctx.channel_id), 'value': move}).encode('utf-8')).decode('utf-8')) for move in moves_san]
-            await ctx.send(content='Legal moves (in alphabetical order):', components=spread_to_rows(*buttons))
+            buttons = [Button(style=ButtonStyle.SECONDARY, label=move, custom_id=f'{MOVE_BUTTON_PREFIX}|{ctx.channel_id}|{move}') for move in moves_san]
+            await ctx.send(content='Legal moves (in alphabetical order):', components=buttons_to_rows(buttons))
         else:
             await ctx.send(content='No legal moves! (Stalemate or checkmate)')
     
+    async def on_move_button(ctx: interactions.ComponentContext, channel_id: str, move: str) -> None:
+        '''Handle a press of one of the buttons sent by /moves.'''
+        try:
+            game_session = game_manager[channel_id]
+        except KeyError:
+            await ctx.send(content='No active game found in this channel!')
+            return
+        await make_move(ctx, game_session, move)
+
+    # Button handlers, keyed by the type prefix of the button's custom ID
+    component_handlers = {
+        MOVE_BUTTON_PREFIX: on_move_button,
+        # TODO: 'n' for new_game, maybe 'l' for moves
+    }
+    # Button types used by the old base64-encoded JSON custom IDs, mapped to their current prefixes
+    legacy_component_types = {'move': MOVE_BUTTON_PREFIX}
+
     @client.event(name='on_component')
     async def on_component(ctx: interactions.ComponentContext) -> None:
-        '''Handle button presses.'''
-        button_context = loads(b64decode(ctx.component.custom_id).decode('utf-8'))
-        # if ctx.component.custom_id == 'new_game':
-        #     await new_game(ctx)
-        # elif ctx.component.custom_id == 'moves':
-        #     await moves(ctx)
-        if button_context['type'] == 'move':
-            channel_id = button_context['channel_id']
-            try:
-                game_session = game_manager[channel_id]
-            except KeyError:
-                await ctx.send(content='No active game found in this channel!')
-                return
-            await make_move(ctx, game_session, button_context['value'])
+        '''Handle button presses by dispatching on the custom ID's type prefix.'''
+        custom_id = ctx.component.custom_id
+        if '|' in custom_id:
+            button_type, channel_id, value = custom_id.split('|', 2)
+        else:
+            # Buttons sent before the compact format used base64-encoded JSON (base64 never contains '|')
+            button_context = orjson.loads(b64decode(custom_id))
+            button_type = legacy_component_types.get(button_context['type'])
+            channel_id, value = button_context['channel_id'], button_context['value']
+        handler = component_handlers.get(button_type)
+        if handler is None:
+            logger.warning('No handler for button with custom ID %s', custom_id)
+            return
+        await handler(ctx, channel_id, value)
 
     @client.command(**commands['game_commands']['lock'])
     async def lock_thread(ctx: interactions.CommandContext) -> None:
@@ -14,6 +14,7 @@
 # - EP_BOT_TOKEN: the Discord bot token, only required for the client end
 # - EP_HOME_GUILD_ID: the Discord guild ID of the guild where the bot stores emoji and receives admin commands, only required for the client end
 # - EP_ADMIN_CHANNEL_ID: the Discord channel ID of the channel where the bot receives admin commands, only required for the client end
+# - EP_DISABLE_COMMAND_SYNC: set to 'true' to skip syncing slash commands with Discord on startup, optional for the client end
 
 from dotenv import load_dotenv
 import logging.config
@@ -39,15 +40,30 @@ BOT_ID = os.getenv('EP_BOT_ID', 'bot_id_unset')
 BOT_TOKEN = os.getenv('EP_BOT_TOKEN', 'bot_token_unset')
 HOME_GUILD_ID = os.getenv('EP_HOME_GUILD_ID', 'home_guild_id_unset')
 ADMIN_CHANNEL_ID = os.getenv('EP_ADMIN_CHANNEL_ID', 'admin_channel_id_unset')
+# The library already pushes all commands in one bulk overwrite when they change, but it still has to fetch and diff them on every start.
+# If the command definitions haven't changed since the last deploy, that round trip can be skipped entirely.
+DISABLE_COMMAND_SYNC = os.getenv('EP_DISABLE_COMMAND_SYNC', 'false').lower() in ('1', 'true', 'yes')
 # Filenames for JSON caches
 ACTIVE_GAMES_CACHE_FILE = os.getenv('EP_ACTIVE_GAMES_CACHE', join('runtime-data', 'active_games.json'))
 EMOJI_CACHE_FILE = os.getenv('EP_EMOJI_CACHE', join('runtime-data', 'emoji_map.json'))
+# Append-only log of changes to the active games since ACTIVE_GAMES_CACHE_FILE was last written (one JSON record per line)
+ACTIVE_GAMES_LOG_FILE = os.getenv('EP_ACTIVE_GAMES_LOG', join('runtime-data', 'active_games.jsonl'))
 
 # Hard-coded values
 ENGINE_URL_AUTH = f'wss://{ENGINE_USER}:{ENGINE_PW}@{ENGINE_HOST}:{ENGINE_PORT}/ws'
 ENGINE_URL_NOAUTH = f'ws://{ENGINE_HOST}:{ENGINE_PORT}/ws'
 ENGINE_URL = ENGINE_URL_AUTH if ENGINE_USER and ENGINE_PW else ENGINE_URL_NOAUTH
 
+# Number of records the active games log can hold before it's compacted into a fresh snapshot
+ACTIVE_GAMES_LOG_COMPACT_THRESHOLD = 1000
+# Number of seconds appended log records may sit in the write buffer before being flushed to disk
+ACTIVE_GAMES_LOG_FLUSH_INTERVAL = 2
+# Number of seconds to wait after a game changes before logging it, so a burst of changes to a game is logged once
+ACTIVE_GAMES_SAVE_DELAY = 0.25
+
+# Buffer size for reading and writing the JSON caches; large enough that a whole cache fits in one write() call
+CACHE_FILE_BUFFER_SIZE = 1 << 20 # 1 MiB
+
 DEFAULT_GAME_OPTIONS = {'variant': 'standard', 'chess960_pos': -1}
 DEFAULT_ENGINE_OPTIONS = {'level': 5, 'depth': 20, 'move_time': 1000, 'engine_color': 'black', 'contempt': 0}
 
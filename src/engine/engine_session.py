@@ -27,9 +27,9 @@
 # The engine will also log to the console and to EnPassant.log.
 
 import asyncio
-import json
 import logging
 
+import orjson
 # TODO: switch from websockets to zmq
 import websockets
 
@@ -57,7 +57,8 @@ async def server(ws):
     while True:
         msg_str = await ws.recv()
         logger.debug(f'Received message from client: {msg_str}')
-        msg = json.loads(msg_str)
+        # orjson parses str and bytes frames alike, and much faster than json
+        msg = orjson.loads(msg_str)
         if msg.get('request') == 'exit':
             logger.info('Client requested exit')
             await ws.close()
@@ -1,8 +1,8 @@
 # Common elements for client and server relating to game state
 
 import logging
+import random
 import re
-import uuid
 from typing import Any, Literal
 
 import chess
@@ -14,9 +14,14 @@ from .player import Player
 
 logger = logging.getLogger(__name__)
 
+# Matches a normal move in UCI, so parse_move can tell it apart from SAN without waiting for Move.from_uci to raise
+_UCI_RE = re.compile(r'^[a-h][1-8][a-h][1-8][qrbn]?$')
+# Parses a single move in SAN or UCI (see tokenize_move)
+_MOVE_RE = re.compile(r'^(?:(?:(?P<piece>[KQRBN])?(?P<from_file>[a-h])?(?P<from_rank>[1-8])?(?P<capture>x)?(?P<to_file>[a-h])(?P<to_rank>[1-8])(?P<promotion>([=/]?[QRBNqrbn]))?|(?P<castle>O-O(?:-O)?))(?P<check>[+#])?|(?P<result>1-0|0-1|1/2-1/2))$')
+
 def generate_session_id():
     '''Generates a unique session ID.'''
-    return str(uuid.uuid4())[8] # doesn't need to be secure, just unique
+    return f'{random.getrandbits(32):08x}' # doesn't need to be secure, just unique
 
 OfferType = Literal['undo', 'draw']
 OfferStatus = Literal['pending', 'accepted', 'declined']
@@ -56,11 +61,14 @@ class GameSession:
     - time_limit: the time limit for each player, in seconds
     - increment: the increment for the game, in seconds
     '''
-    def __init__(self, fen: str = None, moves: list[str] = None, game_options: dict[str, Any] = None, session_id: str | None = None):
+    # One of these is kept per active game, so skip the per-instance __dict__
+    __slots__ = ('session_id', 'status', 'current_offer', 'game_options', 'variant', 'chess960_pos', 'moves', 'board', '_uci_moves', '_fen')
+
+    def __init__(self, fen: str = None, moves: list[str] | str = None, game_options: dict[str, Any] = None, session_id: str | None = None):
         '''
         Set board, fen, game options, variant, chess960 position, and moves.
         :param str fen: the FEN string to set the board to
-        :param list[str] moves: a list of moves in SAN or UCI format to apply to the board on init. Overrides fen string if both are present.
+        :param list[str] | str moves: a list of moves in SAN or UCI format to apply to the board on init, or a space-separated string of them. Overrides fen string if both are present.
         :param dict[str, Any] game_options: a dictionary of game options (e.g. variant)
         :param str session_id: the session ID to use for this game session. If not provided, a random UUID will be used.
         Note: The session ID should generally match the Discord channel ID for the game.
@@ -71,9 +79,11 @@ class GameSession:
         '''
         if moves is None:
             moves = []
+        elif isinstance(moves, str):
+            moves = moves.split()
         if game_options is None:
-            game_options = DEFAULT_GAME_OPTIONS
-        self.session_id: str = str(session_id) or generate_session_id()
+            game_options = dict(DEFAULT_GAME_OPTIONS) # copied, so no two sessions share (and can mutate) the same dict
+        self.session_id: str = str(session_id) if session_id is not None else generate_session_id()
         self.status: GameStatus = GameStatus(outcome='in_progress')
         self.current_offer: Offer | None = None
         self.game_options: dict[str, Any] = game_options
@@ -92,11 +102,15 @@ class GameSession:
         self.moves: list[str] = [] # list of moves in SAN format, maintained throughout the game since the board doesn't store them.
                                    # Stored as SAN regardless of whether the client wants moves displayed in SAN or UCI,
                                    # since the board does store them in UCI format (sort of) via board.move_stack.
-        self.reset_board()
-        if not self.apply_moves(moves):
-            logger.warning('Could not apply moves; reverting to starting position')
+        if not moves:
+            # Nothing to replay, so go straight to the given position (or the starting position if none was given)
             self.reset_board(fen=fen)
-            self.moves = []
+        else:
+            self.reset_board()
+            if not self.apply_moves(moves):
+                logger.warning('Could not apply moves; reverting to starting position')
+                self.reset_board(fen=fen)
+                self.moves = []
 
     def apply_moves(self, moves: list[str]) -> bool:
         '''
@@ -107,9 +121,11 @@ class GameSession:
                 if move_str in ['0-1', '1-0', '1/2-1/2']:
                     logger.info('Loaded board from moves with game over indicated: %s', move_str)
                     break
+                # Stored moves are re-rendered rather than kept as given, since they may be UCI or non-canonical SAN
                 move = self.parse_move(move_str)
-                self.moves.append(self.board.san(move))
-                self.board.push(move)
+                self.moves.append(self.board.san_and_push(move))
+                self._uci_moves.append(move.uci())
+                self._fen = None
             except (chess.InvalidMoveError, chess.AmbiguousMoveError, chess.IllegalMoveError):
                 logger.warning('Could not parse move \'%s\' in moves list!', move_str)
                 return False
@@ -117,10 +133,11 @@ class GameSession:
 
     def reset_board(self, fen: str | None = None) -> chess.Board:
         '''Resets the board to the starting position, or to the position specified by the fen parameter.'''
+        self._uci_moves: list[str] = [] # kept alongside the move stack, since uci_moves is otherwise rebuilt from it on every access
+        self._fen: str | None = None # FEN of the current position, cached until the next move
         if fen is not None:
             try:
-                self.board = chess.Board()
-                self.fen = fen # Also sets the board to the FEN string (gotta remember it's a property)
+                self.board = chess.Board(fen) # Set up from the FEN directly, rather than from the starting position and then the FEN
                 return self.board
             except ValueError:
                 logger.warning('Invalid FEN string \'%s\'; defaulting to starting position', fen)
@@ -148,24 +165,20 @@ class GameSession:
         move_str = move_str.replace('%20', ' ').replace('х', 'x') # A relic of the old days, when the client would send moves as a URL parameter
         move = None
         try:
-            move = chess.Move.from_uci(move_str)
-            # If the move is syntactically valid UCI, but illegal on the current board, we have to check for that, since from_uci doesn't.
-            if not self.board.is_legal(move):
-                raise chess.IllegalMoveError
-        except chess.InvalidMoveError:
-            # It's not valid UCI, so try SAN
-            try:
+            if _UCI_RE.match(move_str):
+                move = chess.Move.from_uci(move_str)
+                # If the move is syntactically valid UCI, but illegal on the current board, we have to check for that, since from_uci doesn't.
+                if not self.board.is_legal(move):
+                    raise chess.IllegalMoveError
+            else:
+                # It's not UCI, so try SAN (which also covers null moves and drops)
                 move = self.board.parse_san(move_str)
-            except chess.InvalidMoveError as ex:
-                logger.warning('Invalid move: \'%s\'', move_str)
-                raise ex
-            except chess.AmbiguousMoveError as ex:
-                logger.warning('Ambiguous move: \'%s\'', move_str)
-                raise ex
-            except Exception as ex:
-                # If it's not an InvalidMoveError or AmbiguousMoveError, it's probably an IllegalMoveError, so we'll just re-raise it for the block below.
-                # And if it's something else, we'll just let it propagate up.
-                raise ex
+        except chess.InvalidMoveError as ex:
+            logger.warning('Invalid move: \'%s\'', move_str)
+            raise ex
+        except chess.AmbiguousMoveError as ex:
+            logger.warning('Ambiguous move: \'%s\'', move_str)
+            raise ex
         except chess.IllegalMoveError as ex:
             logger.warning('Illegal move: \'%s\'', move_str)
             raise ex
@@ -179,13 +192,14 @@ class GameSession:
         '''
         previous_moves_len = len(self.moves)
         if move is not None:
-            # Both board.san and board.push raise IllegalMoveError, but board.san doesn't catch all of them.
-            # So it might be unclear whether self.moves was updated or not when an exception is raised,
-            # so we'll keep track of the previous length and revert to that if an exception is raised.
+            # board.san_and_push renders the SAN and pushes the move in one go, instead of board.san pushing and popping it
+            # to check for check and then board.push pushing it again.
+            # It can still raise IllegalMoveError, so we'll keep track of the previous length and revert to that if an exception is raised.
             # It's the caller's responsibility to ensure that the move is legal BEFORE calling this method.
             try:
-                self.moves.append(self.board.san(move))
-                self.board.push(move)
+                self.moves.append(self.board.san_and_push(move))
+                self._uci_moves.append(move.uci())
+                self._fen = None
             except chess.IllegalMoveError as ex:
                 # I would mark this as critical, but it's recoverable, so I'll just mark it as an error.
                 logger.error('Illegal move in push_move: \'%s\'. This should not happen.', move)
@@ -195,13 +209,17 @@ class GameSession:
     def check_warning(self, move_str: str) -> str | None:
         '''If the given move specifies check or checkmate, verify that it is correct.
         Also provide messages for when check or other non-game-ending states have occurred.'''
-        if self.board.is_check() and not self.board.is_checkmate():
-            if move_str.endswith('#'):
+        # Look at the suffix and the check state once each; checkmate only needs checking when in check
+        suffix = move_str[-1:]
+        if self.board.is_check():
+            if self.board.is_checkmate():
+                return None
+            if suffix == '#':
                 return 'User called a checkmate, but this move results in check!'
             return 'Check!'
-        if move_str.endswith('+') and not self.board.is_check():
+        if suffix == '+':
             return 'User called a check, but this move does not result in check!'
-        if move_str.endswith('#') and not self.board.is_checkmate():
+        if suffix == '#':
             return 'User called a checkmate, but this move does not result in checkmate!'
         return None
 
@@ -209,9 +227,10 @@ class GameSession:
         '''Returns a serializable dict representation of this object.'''
         # It shouldn't be strictly necessary to include the fen parameter, since it's only used in initialization
         # if the moves list is empty, but it's included for completeness.
+        # Moves are stored as one space-separated string rather than a list, which is noticeably smaller for long games.
         ret = {
             'fen': self.fen,
-            'moves': self.moves,
+            'moves': ' '.join(self.moves),
             'game_options': self.game_options,
             'session_id': self.session_id,
         }
@@ -237,7 +256,9 @@ class GameSession:
     @property
     def fen(self) -> str:
         '''Returns the FEN of the current board position.'''
-        return self.board.fen()
+        if self._fen is None:
+            self._fen = self.board.fen()
+        return self._fen
 
     @fen.setter
     def fen(self, fen: str | None) -> None:
@@ -246,6 +267,8 @@ class GameSession:
             self.reset_board()
         else:
             self.board.set_fen(fen)
+            self._uci_moves = []
+            self._fen = None
 
     @property
     def san_moves(self) -> list[str]:
@@ -255,7 +278,7 @@ class GameSession:
     @property
     def uci_moves(self) -> list[str]:
         '''Returns the list of moves in UCI.'''
-        return [move.uci() for move in self.board.move_stack]
+        return self._uci_moves
 
     @property
     def is_game_over(self):
@@ -336,43 +359,64 @@ def levenshtein(s1: str, s2: str) -> int:
     if len(s2) == 0:
         return len(s1)
 
-    previous_row = range(len(s2) + 1)
-    for i, c1 in enumerate(s1):
-        current_row = [i + 1]
-        for j, c2 in enumerate(s2):
-            insertions = previous_row[j + 1] + 1 # j+1 instead of j since previous_row and current_row are one character longer
-            deletions = current_row[j] + 1       # than s2
-            substitutions = previous_row[j] + (c1 != c2)
-            current_row.append(min(insertions, deletions, substitutions))
-        previous_row = current_row
-
-    return previous_row[-1]
-
-def correct_bad_move(move_str: str, board: chess.Board) -> list[str]:
+    # Myers' bit-parallel algorithm: instead of filling in the DP table one cell at a time, each column is kept as a pair of bitmasks
+    # of the vertical +1/-1 differences between adjacent cells (one bit per character of s2), so a whole column is computed with a
+    # handful of integer operations per character of s1. Python ints are arbitrary-precision, so there's no 64-character limit.
+    mask = (1 << len(s2)) - 1
+    last = 1 << (len(s2) - 1)
+    # Bitmask of the positions in s2 where each character occurs
+    peq: dict[str, int] = {}
+    for i, c in enumerate(s2):
+        peq[c] = peq.get(c, 0) | (1 << i)
+    pv = mask # positive vertical differences
+    mv = 0    # negative vertical differences
+    distance = len(s2)
+    for c in s1:
+        eq = peq.get(c, 0)
+        xv = eq | mv
+        xh = (((eq & pv) + pv) ^ pv) | eq
+        ph = mv | ~(xh | pv) # positive horizontal differences
+        mh = pv & xh         # negative horizontal differences
+        # The bottom row of the table is the distance so far
+        if ph & last:
+            distance += 1
+        elif mh & last:
+            distance -= 1
+        # The top row of the table goes up by one per character, hence the 1 shifted in
+        ph = (ph << 1) | 1
+        mh <<= 1
+        pv = (mh | ~(xv | ph)) & mask
+        mv = ph & xv & mask
+
+    return distance
+
+def correct_bad_move(move_str: str, board: chess.Board, legal_moves_san: list[str] | None = None) -> list[str]:
     '''
     Returns a list of all legal moves resembling the given move, in SAN format.
     If the given move string is more than 2 characters long, only moves that are within 2 levenshtein distance of the given move will be returned.
     Otherwise, all legal moves that are within 1 levenshtein distance of the given move will be returned.
+    If the caller already has the legal moves in SAN for this position, pass them as legal_moves_san to skip generating them again.
     '''
-    matches = []
-    for legal_move in board.legal_moves:
-        if levenshtein(move_str, board.san(legal_move)) <= min(2, len(move_str) - 1):
-            matches.append(board.san(legal_move))
+    # board.san has to generate the legal moves itself to disambiguate, so don't call it more than once per move
+    if legal_moves_san is None:
+        legal_moves_san = map(board.san, board.legal_moves)
+    # The distance is at least the difference in length, so that alone rules out most legal moves without running levenshtein
+    max_distance = min(2, len(move_str) - 1)
+    matches = [san for san in legal_moves_san
+               if abs(len(san) - len(move_str)) <= max_distance and levenshtein(move_str, san) <= max_distance]
     return sorted(matches)
 
 def disambiguate_move(ambiguous_san: str, board: chess.Board) -> list[str]:
     '''Returns a list of all legal moves that match the given ambiguous move string, in SAN format.'''
-    matches = []
-    for move in board.legal_moves:
-        legal_move_tokens = tokenize_move(board.san(move))
-        ambiguous_move_tokens = tokenize_move(ambiguous_san)
-        if legal_move_tokens['piece'] == ambiguous_move_tokens['piece'] and \
-            legal_move_tokens['to_rank'] == ambiguous_move_tokens['to_rank'] and \
-            legal_move_tokens['to_file'] == ambiguous_move_tokens['to_file']:
-            # All the legal moves that match the given move are the same piece moving to the same square
-            matches.append(board.san(move))
-
-    return matches
+    ambiguous_move_tokens = tokenize_move(ambiguous_san)
+    if not ambiguous_move_tokens.get('piece') or not ambiguous_move_tokens.get('to_file'):
+        return []
+    # All the legal moves that match the given move are the same piece moving to the same square,
+    # which can be read straight off the move and board without rendering or parsing every legal move's SAN
+    piece_type = chess.PIECE_SYMBOLS.index(ambiguous_move_tokens['piece'].lower())
+    to_square = chess.parse_square(ambiguous_move_tokens['to_file'] + ambiguous_move_tokens['to_rank'])
+    return [board.san(move) for move in board.legal_moves
+            if move.to_square == to_square and board.piece_type_at(move.from_square) == piece_type]
 
 def tokenize_move(move: str) -> dict[str, str]:
     '''
@@ -396,8 +440,7 @@ def tokenize_move(move: str) -> dict[str, str]:
     overspecified for a pawn SAN move, and includes a capture, which is not allowed in UCI.
     '''
     ret = {}
-    pattern = re.compile(r'^(?:(?:(?P<piece>[KQRBN])?(?P<from_file>[a-h])?(?P<from_rank>[1-8])?(?P<capture>x)?(?P<to_file>[a-h])(?P<to_rank>[1-8])(?P<promotion>([=\/]?[QRBNqrbn]))?|(?P<castle>O-O(?:-O)?))(?P<check>[+#])?|(?P<result>1-0|0-1|1\/2-1\/2))$')
-    match = pattern.match(move)
+    match = _MOVE_RE.match(move)
     if match:
         ret = match.groupdict()
         # Normalize promotion syntax (uppercase, strip prefix)
@@ -49,18 +49,23 @@ class Player:
         self.color = Color(self.color)
 
     def to_dict(self) -> dict[str, Any]:
+        # Every value is a JSON-native type, so the serializer never needs a fallback
         return {
             'id': self.id,
             'nick': self.nick,
-            'color': str(self.color),
+            'color': self.color,
             'engine': self.engine
         }
     
     @classmethod
     def from_dict(cls, data: dict[str, Any]) -> 'Player':
+        color = data['color']
+        # Older saves stored the color as the string 'True' or 'False', and Color('False') is True
+        if isinstance(color, str):
+            color = color == 'True'
         return cls(
             id=data['id'],
             nick=data['nick'],
-            color=Color(data['color']),
+            color=Color(color),
             engine=data['engine']
         )
@@ -2,7 +2,7 @@
 
 import json
 
-from game import tokenize_move, GameSession
+from game import tokenize_move, GameSession, levenshtein
 
 # For each key in the second dict, if the key is present in the first dict, assert that the values are equal
 def assert_contains(dict1, dict2):
@@ -48,6 +48,35 @@ def test_tokenize_move():
     assert tokenize_move('Qh4xd4d') == {}
     assert tokenize_move('a8=') == {}
 
+def test_levenshtein():
+    # Each case is (s1, s2, known distance); the distance is symmetric, so check both orders
+    cases = [
+        # Empty strings
+        ('', '', 0),
+        ('', 'Nf3', 3),
+        # Equal strings
+        ('e4', 'e4', 0),
+        ('Qh4xe1#', 'Qh4xe1#', 0),
+        # A single insertion, deletion, or substitution
+        ('e4', 'e45', 1),
+        ('Nf3', 'N3', 1),
+        ('Nf3', 'Nf4', 1),
+        # Transpositions count as two substitutions
+        ('e4', '4e', 2),
+        ('Nbd7', 'Ndb7', 2),
+        # Strings of different lengths
+        ('kitten', 'sitting', 3),
+        ('O-O', 'O-O-O', 2),
+        ('Qxe7+', 'e7', 3),
+        ('flaw', 'lawn', 2),
+        # Longer than 64 characters, past the width of a machine word
+        ('a' * 100, 'a' * 99 + 'b', 1),
+        ('ab' * 50, 'ba' * 50, 2),
+    ]
+    for s1, s2, distance in cases:
+        assert levenshtein(s1, s2) == distance, (s1, s2)
+        assert levenshtein(s2, s1) == distance, (s2, s1)
+
 def test_serialize_game_session():
     game_session = GameSession(moves=['e4', 'e5', 'Qh5', 'Nc6', 'Bc4', 'Nf6'],
                                fen='r1bqkb1r/pppp1ppp/2n2n2/4p2Q/2B1P3/8/PPPP1PPP/RNB1K1NR w KQkq - 4 4',
@@ -59,4 +88,5 @@ def test_serialize_game_session():
     assert_dict_equal(game_session_loaded.game_options, game_session.game_options)
     assert game_session_loaded.session_id == game_session.session_id
 
+test_levenshtein()
 test_serialize_game_session()
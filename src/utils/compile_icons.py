@@ -1,7 +1,10 @@
 #!/usr/bin/env python3
 
 import argparse
+import asyncio
 import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from io import BytesIO
 
 from cairosvg import svg2png
@@ -18,6 +21,59 @@ MAX_FILE_SIZE = 256 * 1024  # 256 kB
 OUTPUT_WIDTH = 128
 OUTPUT_HEIGHT = 128
 
+# Maximum number of emoji requests to have in flight at once, to stay friendly with Discord's rate limits
+MAX_CONCURRENT_REQUESTS = 5
+
+def encode_png(image):
+    '''Encode the image as a PNG at maximum compression and return the bytes.'''
+    buffer = BytesIO()
+    image.save(buffer, format='PNG', optimize=True)
+    return buffer.getvalue()
+
+def save_compressed(image, output_filepath):
+    '''
+    Compress the image to the desired file size and save it as a PNG file.
+    Returns the number of palette colors used, or None if the image fit without reducing colors.
+    '''
+    # PNG is lossless, so Pillow ignores the quality setting; the only way to shrink the file further is to reduce the colors
+    data = encode_png(image)
+    colors = None
+    if len(data) > MAX_FILE_SIZE:
+        # Binary search for the most palette colors that still fit, falling back to the fewest if none do
+        low, high = 2, 256
+        data = encode_png(image.quantize(colors=low))
+        colors = low
+        while low < high:
+            mid = (low + high + 1) // 2
+            candidate = encode_png(image.quantize(colors=mid))
+            if len(candidate) <= MAX_FILE_SIZE:
+                low, data, colors = mid, candidate, mid
+            else:
+                high = mid - 1
+    # Write the encoded bytes directly, rather than decoding and re-encoding them
+    with open(output_filepath, 'wb') as f:
+        f.write(data)
+    return colors
+
+def render_svg(svg_path, backgrounds, output_path, svg_file):
+    '''Rasterize one SVG file and composite it onto every background. Runs in a worker process.'''
+    # Rasterize the SVG file once for all backgrounds, directly at the output size
+    svg_buf = BytesIO()
+    svg2png(url=os.path.join(svg_path, svg_file), output_width=OUTPUT_WIDTH, output_height=OUTPUT_HEIGHT, write_to=svg_buf)
+    svg = Image.open(svg_buf).convert('RGBA')
+
+    messages = []
+    for bg_file, bg in backgrounds.items():
+        # Composite the SVG file over the background in a single pass; this returns a new image, leaving the background for the next SVG
+        icon = Image.alpha_composite(bg, svg)
+
+        # Save the compressed image as a PNG file
+        output_filename = os.path.splitext(svg_file)[0] + os.path.splitext(bg_file)[0] + '.png'
+        output_filepath = os.path.join(output_path, output_filename)
+        colors = save_compressed(icon, output_filepath)
+        messages.append('Wrote new file {}, colors={}'.format(output_filepath, colors or 'full'))
+    return messages
+
 def process(args):
     # Load the SVG files into a list
     svg_files = os.listdir(args.svg_path)
@@ -31,42 +87,19 @@ def process(args):
         os.remove(os.path.join(args.output_path, existing_file))
 
     print('Combining {} foreground images with {} backgrounds.'.format(len(svg_files), len(bg_files)))
-    # Loop through all combinations of SVG files and backgrounds
-    for svg_file in svg_files:
-        for bg_file in bg_files:
-            # Load the SVG file
-            svg_buf = BytesIO()
-            svg2png(url=os.path.join(args.svg_path, svg_file), parent_width=OUTPUT_WIDTH, parent_height=OUTPUT_HEIGHT, write_to=svg_buf)
-            svg = Image.open(svg_buf)
-
-            # Load the background image
-            bg = Image.open(os.path.join(args.bg_path, bg_file))
-
-            # Resize the SVG file to match the size of the background image
-            svg = svg.resize(bg.size)
-
-            # Paste the SVG file onto the background image
-            bg.paste(svg, (0, 0), svg)
-
-            # Resize the image to 128x128
-            bg = bg.resize((OUTPUT_WIDTH, OUTPUT_HEIGHT))
-
-            # Compress the image to the desired file size
-            quality = 95
-            while True:
-                buffer = BytesIO()
-                bg.save(buffer, format='PNG', optimize=True, quality=quality)
-                if buffer.tell() <= MAX_FILE_SIZE or quality == 5:
-                    break
-                quality -= 5
-                buffer.close()
-            compressed_image = Image.open(buffer)
-
-            # Save the compressed image as a PNG file
-            output_filename = os.path.splitext(svg_file)[0] + os.path.splitext(bg_file)[0] + '.png'
-            output_filepath = os.path.join(args.output_path, output_filename)
-            compressed_image.save(output_filepath, format='PNG')
-            print('Wrote new file {}, quality={}'.format(output_filepath, quality))
+    # Load each background once, up front, rather than once per SVG file.
+    # Scaling them to the output size here means each composite is done at 128x128 and needs no resizing afterwards.
+    backgrounds = {}
+    for bg_file in bg_files:
+        with Image.open(os.path.join(args.bg_path, bg_file)) as bg:
+            backgrounds[bg_file] = bg.convert('RGBA').resize((OUTPUT_WIDTH, OUTPUT_HEIGHT))
+
+    # Each SVG file is independent, so spread them across all cores
+    render = partial(render_svg, args.svg_path, backgrounds, args.output_path)
+    with ProcessPoolExecutor() as executor:
+        for messages in executor.map(render, svg_files):
+            for message in messages:
+                print(message)
     if args.upload:
         upload(args.output_path)
 
@@ -75,15 +108,25 @@ def upload(output_path):
     @bot.event
     async def on_ready():
         guild: interactions.Guild = get(bot, interactions.Guild, id=int(HOME_GUILD_ID))
-        # Delete all existing custom emojis first
-        for emoji in await guild.get_all_emoji():
-            print(f'Deleting {emoji.name} ({emoji.id})')
-            await emoji.delete()
-        # Upload the new custom emojis
-        for filename in os.listdir(output_path):
+        # Run requests concurrently, but only a few at a time
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+
+        async def delete_emoji(emoji):
+            async with semaphore:
+                print(f'Deleting {emoji.name} ({emoji.id})')
+                await emoji.delete()
+
+        async def upload_emoji(filename):
             with open(os.path.join(output_path, filename), 'rb') as image_file:
-                await guild.create_emoji(name=filename.split('.')[0], image=image_file.read())
+                image = image_file.read()
+            async with semaphore:
+                await guild.create_emoji(name=filename.split('.')[0], image=image)
             print('Uploaded {}'.format(filename))
+
+        # Delete all existing custom emojis first
+        await asyncio.gather(*(delete_emoji(emoji) for emoji in await guild.get_all_emoji()))
+        # Upload the new custom emojis
+        await asyncio.gather(*(upload_emoji(filename) for filename in os.listdir(output_path)))
         await bot.close()
         print('Done!')
 